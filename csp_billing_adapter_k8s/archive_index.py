@@ -0,0 +1,142 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Utility functions for the metering archive index.
+
+The index maps each billing_time to the offset and length of the entry
+in the serialized archive, along with a summary of the billing status.
+This allows a single entry, or the status of all entries, to be
+retrieved without parsing the full archive. The index is stored with a
+digest of the serialized archive it was built for so a stale index is
+not used to locate entries.
+"""
+
+import hashlib
+import logging
+
+from csp_billing_adapter_k8s import codec
+
+log = logging.getLogger('CSPBillingAdapter')
+
+
+def summarize_billing_status(entry: dict) -> dict:
+    """
+    Return a mapping of dimension to status for the archive entry
+
+    :param entry: The archive entry to summarize.
+    :return: A dictionary mapping each billed dimension to the status.
+    """
+    return {
+        dimension: status.get('status')
+        for dimension, status in entry.get('billing_status', {}).items()
+    }
+
+
+def serialize_archive(archive_data: list) -> (str, dict):
+    """
+    Serialize the archive and build the index in a single pass
+
+    The serialized archive is identical to codec.dumps_str(archive_data).
+    If a billing_time appears more than once the index refers to the
+    most recent entry.
+
+    :param archive_data: The list of archive entries.
+    :return:
+        A tuple of the serialized archive and the index mapping
+        billing_time to the entry offset, length and status summary.
+    """
+    encoded_entries = [codec.dumps_str(entry) for entry in archive_data]
+    index = {}
+    offset = 1  # Skip opening bracket
+
+    for entry, encoded in zip(archive_data, encoded_entries):
+        billing_time = entry.get('billing_time')
+
+        if billing_time:
+            index[billing_time] = {
+                'offset': offset,
+                'length': len(encoded),
+                'billing_status': summarize_billing_status(entry)
+            }
+
+        offset += len(encoded) + 1  # Account for "," separator
+
+    return '[' + ','.join(encoded_entries) + ']', index
+
+
+def archive_digest(archive: str) -> str:
+    """
+    Return the SHA-256 hex digest of the serialized archive
+
+    :param archive: The serialized archive.
+    :return: The digest of the UTF-8 encoded archive.
+    """
+    return hashlib.sha256(archive.encode()).hexdigest()
+
+
+def get_indexed_entry(archive: str, index: dict, billing_time: str):
+    """
+    Return the archive entry for billing_time using the index
+
+    Only the slice of the serialized archive holding the entry is parsed.
+    The entry is only returned if the slice parses and has the requested
+    billing time.
+
+    :param archive: The serialized archive.
+    :param index: The archive index.
+    :param billing_time: The billing time of the entry to return.
+    :return:
+        The archive entry or None if the billing time is not indexed or
+        the slice does not hold the entry.
+    """
+    location = index.get(billing_time)
+
+    if not location:
+        return None
+
+    start = location['offset']
+
+    try:
+        entry = codec.loads(archive[start:start + location['length']])
+    except ValueError:
+        log.warning(f'Archive index entry for {billing_time} is invalid.')
+        return None
+
+    if (
+        not isinstance(entry, dict)
+        or entry.get('billing_time') != billing_time
+    ):
+        log.warning(f'Archive index entry for {billing_time} is stale.')
+        return None
+
+    return entry
+
+
+def build_status_overview(archive_data: list) -> dict:
+    """
+    Return a mapping of billing_time to billing status summary
+
+    Used when no index exists for the archive.
+
+    :param archive_data: The list of archive entries.
+    :return: A dictionary mapping billing_time to the status summary.
+    """
+    return {
+        entry['billing_time']: summarize_billing_status(entry)
+        for entry in archive_data
+        if entry.get('billing_time')
+    }
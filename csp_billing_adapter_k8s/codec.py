@@ -0,0 +1,118 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+JSON codec used for all data stored by the plugin.
+
+orjson is used when it is installed, otherwise the standard library json
+module is used. Both produce compact, byte identical UTF-8 JSON. Values
+orjson cannot serialize, such as integers larger than 64 bits or
+non-string keys, fall back to the standard library. So do values orjson
+serializes differently: floats smaller than 1e-4 or greater than or
+equal to 1e16, which it formats without the same exponent, and NaN and
+Infinity, which it writes as null.
+"""
+
+import json
+import math
+import re
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+SEPARATORS = (',', ':')
+
+# Substrings of numbers in the orjson output that the standard library
+# formats differently: the exponent of floats of at least 1e16 and the
+# leading zeros or negative exponent of floats smaller than 1e-4. Bytes
+# searches for them are far cheaper than a regular expression over the
+# whole output, which is only used to rule out matches inside strings.
+_FLOAT_MARKERS = (b'0.0000', b'e-', b'e1', b'e2', b'e3')
+_DIFFERENT_FLOAT = re.compile(
+    rb'(?:^|[:,\[])-?(?:[0-9]+(?:\.[0-9]+)?e|0\.0000)'
+)
+
+
+def _has_non_finite_float(obj) -> bool:
+    """Return True if obj contains a NaN or infinite float."""
+    stack = [obj]
+
+    while stack:
+        value = stack.pop()
+
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+
+    return False
+
+
+def _matches_stdlib(obj, data: bytes) -> bool:
+    """
+    Return True if the orjson output of obj matches the standard library
+
+    orjson writes NaN and Infinity as null so obj is only searched for
+    them if the output contains null.
+    """
+    if any(marker in data for marker in _FLOAT_MARKERS):
+        if _DIFFERENT_FLOAT.search(data):
+            return False
+
+    return b'null' not in data or not _has_non_finite_float(obj)
+
+
+def dumps(obj) -> bytes:
+    """Return obj serialized as UTF-8 encoded JSON."""
+    if orjson is not None:
+        try:
+            data = orjson.dumps(obj, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            pass
+        else:
+            if _matches_stdlib(obj, data):
+                return data
+
+    return json.dumps(
+        obj,
+        separators=SEPARATORS,
+        ensure_ascii=False
+    ).encode()
+
+
+def dumps_str(obj) -> str:
+    """Return obj serialized as a JSON string."""
+    if orjson is not None:
+        return dumps(obj).decode()
+
+    return json.dumps(obj, separators=SEPARATORS, ensure_ascii=False)
+
+
+def loads(data):
+    """Return the object deserialized from JSON str or bytes."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Values such as NaN written by the standard library
+            pass
+
+    return json.loads(data)
@@ -0,0 +1,144 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Credential management for the plugin's API client.
+
+The client configuration is loaded once and cached. When running in a
+cluster the projected service account token file is watched for
+rotation using its modification time and the bearer token is updated
+in place on the cached configuration. Clients built from the
+configuration use the new token without being rebuilt.
+"""
+
+import logging
+import os
+import threading
+
+from kubernetes import client
+from kubernetes.config import (
+    ConfigException,
+    load_incluster_config,
+    load_kube_config
+)
+from kubernetes.config.incluster_config import SERVICE_TOKEN_FILENAME
+
+from csp_billing_adapter_k8s import tracing
+
+log = logging.getLogger('CSPBillingAdapter')
+
+
+class CredentialManager:
+    """
+    Cache the client configuration and refresh the bearer token
+
+    :param token_path:
+        The service account token file used when running in a cluster.
+    """
+
+    def __init__(self, token_path: str = SERVICE_TOKEN_FILENAME):
+        self.token_path = token_path
+        self.configuration = None
+        self.in_cluster = False
+        self.token_mtime = None
+        self._lock = threading.Lock()
+
+    def load(self) -> client.Configuration:
+        """
+        Return the client configuration, loading it on first use
+
+        In cluster config is tried first for running in a container.
+        Then kube config is used if running on control plane.
+        """
+        with self._lock:
+            if self.configuration is not None:
+                return self.configuration
+
+            configuration = client.Configuration()
+
+            with tracing.span('k8s.load_config') as current:
+                try:
+                    # The token is refreshed by the manager on rotation
+                    load_incluster_config(
+                        client_configuration=configuration,
+                        try_refresh_token=False
+                    )
+                    self.in_cluster = True
+                    self.token_mtime = self._get_token_mtime()
+                    current.set_attribute('k8s.config', 'incluster')
+                    log.info('Loaded in cluster config.')
+                except ConfigException:
+                    load_kube_config(client_configuration=configuration)
+                    current.set_attribute('k8s.config', 'kubeconfig')
+                    log.info('Loaded Kube config.')
+
+            self.configuration = configuration
+            return configuration
+
+    def _get_token_mtime(self):
+        try:
+            return os.stat(self.token_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh_if_rotated(self) -> bool:
+        """
+        Refresh the bearer token if the token file has changed
+
+        This is a single stat call and is run before every request.
+        Returns True if the token was refreshed.
+        """
+        if not self.in_cluster or self._get_token_mtime() == self.token_mtime:
+            return False
+
+        log.info('Service account token rotated.')
+        return self.refresh()
+
+    def refresh(self) -> bool:
+        """
+        Refresh the bearer token on the cached configuration
+
+        In cluster the token is read from the token file. Otherwise
+        the kube config is loaded again into the cached configuration.
+        Returns False if no configuration has been loaded.
+        """
+        with self._lock:
+            if self.configuration is None:
+                return False
+
+            with tracing.span('k8s.refresh_token'):
+                if self.in_cluster:
+                    self._read_token()
+                else:
+                    load_kube_config(client_configuration=self.configuration)
+
+        log.info('Refreshed API credentials.')
+        return True
+
+    def _read_token(self):
+        mtime = self._get_token_mtime()
+
+        with open(self.token_path) as token_file:
+            token = token_file.read()
+
+        if not token:
+            raise ConfigException('Token file exists but empty.')
+
+        api_key = self.configuration.api_key
+        # The key name depends on the kubernetes client version
+        key = 'authorization' if 'authorization' in api_key else 'BearerToken'
+        api_key[key] = 'bearer ' + token
+        self.token_mtime = mtime
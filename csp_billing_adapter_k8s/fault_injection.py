@@ -0,0 +1,514 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Fault injection and latency simulation for the plugin's API client.
+
+The FaultInjectingTransport replaces the urllib3 pool manager of a
+kubernetes ApiClient. Requests are served by an in-memory FakeApiServer
+so no cluster is required. Latency, error responses, connection resets
+and truncated bodies are injected based on a FaultProfile and are
+deterministic for a given seed.
+
+run_scenario runs the plugin hooks against a fault profile and reports
+the hook latency, retry counts and correctness.
+"""
+
+import copy
+import json
+import random
+import time
+
+from urllib.parse import urlparse
+
+import urllib3
+
+from kubernetes import client
+from urllib3.exceptions import ProtocolError
+
+from csp_billing_adapter.config import Config
+
+
+class FakeApiServer:
+    """
+    In-memory k8s API server for secrets, config maps and custom objects
+
+    Objects are stored by request path. Only the operations used by the
+    plugin are implemented: create, read, strategic merge patch of the
+    data map, reading custom objects and API discovery.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.resource_version = 0
+        self.api_groups = {}
+
+    def _next_resource_version(self):
+        self.resource_version += 1
+        return str(self.resource_version)
+
+    def add_object(self, path: str, obj: dict):
+        obj = copy.deepcopy(obj)
+        obj.setdefault('metadata', {})['resourceVersion'] = (
+            self._next_resource_version()
+        )
+        self.objects[path] = obj
+
+    def get_object(self, path: str):
+        return self.objects.get(path)
+
+    def add_api_resource(
+        self,
+        group: str,
+        version: str,
+        plural: str,
+        namespaced: bool = False,
+        preferred: bool = True
+    ):
+        """
+        Serve the discovery documents for a custom resource version
+
+        The group list at /apis and the resource list of the group
+        version are updated.
+        """
+        versions = self.api_groups.setdefault(group, {})
+        versions[version] = preferred
+        group_versions = [
+            {'groupVersion': f'{group}/{name}', 'version': name}
+            for name in versions
+        ]
+        preferred_version = next(
+            (gv for gv in group_versions if versions[gv['version']]),
+            group_versions[0]
+        )
+        groups = self.objects.setdefault(
+            '/apis',
+            {'kind': 'APIGroupList', 'apiVersion': 'v1', 'groups': []}
+        )['groups']
+        groups[:] = [item for item in groups if item['name'] != group]
+        groups.append({
+            'name': group,
+            'versions': group_versions,
+            'preferredVersion': preferred_version
+        })
+        self.objects[f'/apis/{group}/{version}'] = {
+            'kind': 'APIResourceList',
+            'apiVersion': 'v1',
+            'groupVersion': f'{group}/{version}',
+            'resources': [{
+                'name': plural,
+                'singularName': '',
+                'namespaced': namespaced,
+                'kind': 'UsageRecord',
+                'verbs': ['get', 'list', 'watch']
+            }]
+        }
+
+    def handle(self, method: str, path: str, body) -> (int, dict):
+        """Return the status and response body for the request."""
+        path = path.rstrip('/')
+
+        if method == 'POST':
+            obj = json.loads(body)
+            path = f'{path}/{obj["metadata"]["name"]}'
+
+            if path in self.objects:
+                return 409, status_body(409, 'AlreadyExists')
+
+            self.add_object(path, obj)
+            return 201, self.objects[path]
+
+        if path not in self.objects:
+            return 404, status_body(404, 'NotFound')
+
+        obj = self.objects[path]
+
+        if method == 'PATCH':
+            patch = json.loads(body)
+            obj.setdefault('data', {}).update(patch.get('data', {}))
+            obj['metadata']['resourceVersion'] = (
+                self._next_resource_version()
+            )
+        elif method != 'GET':
+            return 405, status_body(405, 'MethodNotAllowed')
+
+        return 200, obj
+
+
+def status_body(code: int, reason: str) -> dict:
+    """Return a k8s Status object for an error response."""
+    return {
+        'kind': 'Status',
+        'apiVersion': 'v1',
+        'status': 'Failure',
+        'message': f'Injected {reason}',
+        'reason': reason,
+        'code': code
+    }
+
+
+class FaultProfile:
+    """
+    Configuration of the faults injected by the transport
+
+    :param latency:
+        The latency distribution as a tuple of name and parameters
+        in seconds. One of ('constant', value), ('uniform', low, high),
+        ('exponential', mean) or ('lognormal', mu, sigma).
+    :param error_rates:
+        A dictionary mapping HTTP status code to the probability of
+        a request returning that status.
+    :param reset_rate: The probability of a connection reset.
+    :param truncate_rate: The probability of a truncated response body.
+    :param seed: The seed for the random number generator.
+    """
+
+    def __init__(
+        self,
+        latency: tuple = ('constant', 0),
+        error_rates: dict = None,
+        reset_rate: float = 0.0,
+        truncate_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.latency = latency
+        self.error_rates = error_rates or {}
+        self.reset_rate = reset_rate
+        self.truncate_rate = truncate_rate
+        self.seed = seed
+
+
+PROFILES = {
+    'healthy': FaultProfile(),
+    'slow': FaultProfile(latency=('lognormal', -1.5, 0.75)),
+    'throttled': FaultProfile(
+        latency=('uniform', 0.01, 0.05),
+        error_rates={429: 0.3}
+    ),
+    'flapping': FaultProfile(
+        latency=('exponential', 0.05),
+        error_rates={500: 0.15},
+        reset_rate=0.1
+    ),
+    'conflicts': FaultProfile(error_rates={409: 0.2}),
+    'expired': FaultProfile(error_rates={410: 0.2}),
+    'truncated': FaultProfile(truncate_rate=0.2),
+}
+
+
+class FaultInjectingTransport:
+    """
+    urllib3 pool manager replacement that injects faults
+
+    Requests that are not failed are passed to the backend server.
+    Latency is applied using the provided sleep function which allows
+    a simulated clock to be used.
+    """
+
+    def __init__(
+        self,
+        backend: FakeApiServer,
+        profile: FaultProfile,
+        sleep=time.sleep
+    ):
+        self.backend = backend
+        self.profile = profile
+        self.sleep = sleep
+        self.random = random.Random(profile.seed)
+        self.requests = 0
+        self.faults = {}
+
+    def _latency(self) -> float:
+        name, *params = self.profile.latency
+
+        if name == 'uniform':
+            return self.random.uniform(*params)
+        elif name == 'exponential':
+            return self.random.expovariate(1 / params[0])
+        elif name == 'lognormal':
+            return self.random.lognormvariate(*params)
+
+        return params[0]
+
+    def _choose_fault(self):
+        draw = self.random.random()
+        faults = [
+            ('reset', self.profile.reset_rate),
+            ('truncate', self.profile.truncate_rate),
+            *self.profile.error_rates.items()
+        ]
+
+        for fault, rate in faults:
+            if draw < rate:
+                return fault
+
+            draw -= rate
+
+        return None
+
+    def _record_fault(self, fault):
+        self.faults[fault] = self.faults.get(fault, 0) + 1
+
+    def request(self, method, url, body=None, **kwargs):
+        self.requests += 1
+        self.sleep(self._latency())
+
+        fault = self._choose_fault()
+
+        if fault == 'reset':
+            self._record_fault(fault)
+            raise ProtocolError(
+                'Connection aborted.',
+                ConnectionResetError(104, 'Connection reset by peer')
+            )
+        elif fault not in (None, 'truncate'):
+            self._record_fault(fault)
+            status, data = fault, status_body(fault, 'Injected')
+        else:
+            if isinstance(body, bytes):
+                body = body.decode()
+
+            status, data = self.backend.handle(
+                method,
+                urlparse(url).path,
+                body
+            )
+
+        payload = json.dumps(data).encode()
+
+        if fault == 'truncate':
+            self._record_fault(fault)
+            payload = payload[:len(payload) // 2]
+
+        return urllib3.HTTPResponse(
+            body=payload,
+            status=status,
+            headers={'Content-Type': 'application/json'},
+            preload_content=True
+        )
+
+    def clear(self):
+        pass
+
+
+def create_api_client(transport: FaultInjectingTransport):
+    """Return a kubernetes ApiClient that uses the provided transport."""
+    configuration = client.Configuration()
+    configuration.host = 'http://fake-api-server'
+    api_client = client.ApiClient(configuration)
+    api_client.rest_client.pool_manager = transport
+    return api_client
+
+
+class SimulatedClock:
+    """Clock advanced by simulated latency instead of sleeping."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+def _percentile(values: list, percentile: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(int(len(values) * percentile), len(values) - 1)]
+
+
+def run_scenario(
+    profile: FaultProfile,
+    iterations: int = 50,
+    retries: int = 3
+) -> dict:
+    """
+    Run billing cycles of the plugin hooks against the fault profile
+
+    Each hook call is retried up to retries times. Successful writes
+    are checked against the state of the fake server and successful
+    reads against the last written values.
+
+    :return:
+        A dictionary mapping hook name to the number of calls,
+        failures, retries, incorrect results and latency percentiles
+        in seconds, along with the injected fault counts.
+    """
+    from csp_billing_adapter_k8s import plugin
+
+    config = Config({
+        'usage_metrics': {
+            'managed_node_count': {'usage_aggregation': 'average'}
+        }
+    })
+    namespace = plugin.namespace
+    cache_path = f'/api/v1/namespaces/{namespace}/secrets/csp-adapter-cache'
+    csp_config_path = f'/api/v1/namespaces/{namespace}/configmaps/csp-config'
+    archive_path = (
+        f'/api/v1/namespaces/{namespace}/configmaps/metering-archive'
+    )
+    usage = {'managed_node_count': 10, 'reporting_time': 'now'}
+
+    server = FakeApiServer()
+    server.add_api_resource(
+        plugin.usage_api_group,
+        plugin.usage_api_version,
+        plugin.usage_crd_plural
+    )
+    server.add_object(
+        f'/apis/{plugin.usage_api_group}/{plugin.usage_api_version}/'
+        f'{plugin.usage_crd_plural}/{plugin.usage_resource}',
+        {'kind': 'UsageRecord', **usage}
+    )
+    clock = SimulatedClock()
+    transport = FaultInjectingTransport(server, profile, sleep=clock.sleep)
+    stats = {}
+
+    def stored(path, key, decode=json.loads):
+        obj = server.get_object(path)
+        data = obj and obj.get('data', {}).get(key)
+        return decode(data) if data else None
+
+    def call(name, func, expected=None, **kwargs):
+        hook_stats = stats.setdefault(name, {
+            'calls': 0,
+            'failures': 0,
+            'retries': 0,
+            'incorrect': 0,
+            'latencies': []
+        })
+        hook_stats['calls'] += 1
+        start = time.perf_counter()
+        simulated_start = clock.now
+        result = None
+
+        for attempt in range(retries + 1):
+            try:
+                result = func(config=config, **kwargs)
+            except Exception:
+                if attempt == retries:
+                    hook_stats['failures'] += 1
+                    break
+
+                hook_stats['retries'] += 1
+            else:
+                if expected is not None and expected() != result:
+                    hook_stats['incorrect'] += 1
+                break
+
+        hook_stats['latencies'].append(
+            time.perf_counter() - start + clock.now - simulated_start
+        )
+        return result
+
+    original_client = plugin.api_client
+    plugin.api_client = create_api_client(transport)
+    plugin.usage_discovery.invalidate()
+
+    try:
+        for iteration in range(iterations):
+            cache = {'iteration': iteration}
+            csp_config = {'iteration': iteration}
+            archive = [{'billing_time': str(i)} for i in range(iteration)]
+
+            def stored_cache():
+                return stored(cache_path, 'data', plugin._decode_cache)
+
+            def stored_csp_config():
+                return stored(csp_config_path, 'data')
+
+            def stored_archive():
+                return stored(archive_path, 'archive') or []
+
+            call('save_cache', plugin.save_cache, cache=cache)
+            call(
+                'update_cache',
+                plugin.update_cache,
+                cache=cache,
+                replace=True
+            )
+            call('get_cache', plugin.get_cache, expected=stored_cache)
+            call(
+                'save_csp_config',
+                plugin.save_csp_config,
+                csp_config=csp_config
+            )
+            call(
+                'update_csp_config',
+                plugin.update_csp_config,
+                csp_config=csp_config,
+                replace=True
+            )
+            call(
+                'get_csp_config',
+                plugin.get_csp_config,
+                expected=stored_csp_config
+            )
+            call(
+                'save_metering_archive',
+                plugin.save_metering_archive,
+                archive_data=archive
+            )
+            call(
+                'get_metering_archive',
+                plugin.get_metering_archive,
+                expected=stored_archive
+            )
+            call(
+                'get_usage_data',
+                plugin.get_usage_data,
+                expected=lambda: usage
+            )
+
+            # Writes are checked against the state they should leave
+            if stored_cache() != cache:
+                stats['update_cache']['incorrect'] += 1
+
+            if stored_csp_config() != csp_config:
+                stats['update_csp_config']['incorrect'] += 1
+
+            if stored_archive() != archive:
+                stats['save_metering_archive']['incorrect'] += 1
+    finally:
+        plugin.api_client = original_client
+        plugin.usage_discovery.invalidate()
+
+    report = {}
+    for name, hook_stats in stats.items():
+        latencies = hook_stats.pop('latencies')
+        report[name] = {
+            **hook_stats,
+            'latency_p50': _percentile(latencies, 0.5),
+            'latency_p95': _percentile(latencies, 0.95),
+            'latency_max': max(latencies)
+        }
+
+    report['faults'] = {str(k): v for k, v in transport.faults.items()}
+    report['requests'] = transport.requests
+    return report
+
+
+def main():
+    """Run every built-in profile and print the reports as JSON."""
+    reports = {
+        name: run_scenario(profile) for name, profile in PROFILES.items()
+    }
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == '__main__':
+    main()
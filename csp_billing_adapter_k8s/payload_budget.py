@@ -0,0 +1,138 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Size budget monitor for objects written to the k8s cluster.
+
+Secrets and ConfigMaps are limited to 1 MiB. The encoded size of each
+write is recorded so the plugin can warn, and compact or compress the
+payload, before the API server rejects a write.
+"""
+
+import logging
+
+from collections import deque
+
+log = logging.getLogger('CSPBillingAdapter')
+
+
+def base64_size(size: int) -> int:
+    """Return the size of size bytes once base64 encoded."""
+    return 4 * ((size + 2) // 3)
+
+
+def utf8_size(text: str) -> int:
+    """Return the size of text encoded as UTF-8."""
+    # ASCII text is the common case and does not need to be encoded
+    return len(text) if text.isascii() else len(text.encode())
+
+
+class PayloadBudget:
+    """
+    Track the encoded size of each object written to the cluster
+
+    When an object reaches warn_ratio of the limit a warning is logged.
+    When it reaches compact_ratio of the limit the payload should be
+    compacted or compressed before writing. The sizes of the most recent
+    writes are kept to project growth.
+    """
+
+    def __init__(
+        self,
+        limit: int = 1048576,
+        warn_ratio: float = 0.8,
+        compact_ratio: float = 0.9,
+        history: int = 10
+    ):
+        self.limit = limit
+        self.warn_ratio = warn_ratio
+        self.compact_ratio = compact_ratio
+        self.history = history
+        self.sizes = {}
+
+    @property
+    def compact_size(self) -> int:
+        """The size in bytes at which a payload should be compacted."""
+        return int(self.limit * self.compact_ratio)
+
+    def should_compact(self, size: int) -> bool:
+        return size >= self.compact_size
+
+    def record(self, name: str, size: int):
+        """
+        Record the encoded size of a write to the named object
+
+        A warning is logged when the size reaches the warning threshold.
+        """
+        sizes = self.sizes.setdefault(name, deque(maxlen=self.history))
+        sizes.append(size)
+
+        ratio = size / self.limit
+
+        if ratio >= 1:
+            log.error(
+                f'{name} is {size} bytes which exceeds the '
+                f'{self.limit} bytes limit.'
+            )
+        elif ratio >= self.warn_ratio:
+            writes = self.writes_until_limit(name)
+            log.warning(
+                f'{name} is {size} bytes, {ratio:.0%} of the '
+                f'{self.limit} bytes limit. Projected writes until '
+                f'limit: {writes if writes is not None else "unknown"}.'
+            )
+
+    def growth_per_write(self, name: str) -> float:
+        """Return the mean change in size over the recent writes."""
+        sizes = self.sizes.get(name)
+
+        if not sizes or len(sizes) < 2:
+            return 0.0
+
+        return (sizes[-1] - sizes[0]) / (len(sizes) - 1)
+
+    def writes_until_limit(self, name: str):
+        """
+        Return the projected number of writes before the limit is reached
+
+        If the object is not growing return None.
+        """
+        growth = self.growth_per_write(name)
+
+        if growth <= 0:
+            return None
+
+        remaining = self.limit - self.sizes[name][-1]
+        return max(int(remaining // growth), 0)
+
+    def report(self) -> dict:
+        """
+        Return the budget status of every recorded object
+
+        For each object the last size, the ratio of the limit used,
+        the growth per write and the projected writes until the limit
+        are included.
+        """
+        return {
+            name: {
+                'size': sizes[-1],
+                'limit': self.limit,
+                'ratio': sizes[-1] / self.limit,
+                'growth_per_write': self.growth_per_write(name),
+                'writes_until_limit': self.writes_until_limit(name)
+            }
+            for name, sizes in self.sizes.items()
+        }
@@ -22,86 +22,211 @@ variables.
 
 
 import base64
+import gzip
 import inspect
-import json
 import logging
 import os
+import threading
 
 import csp_billing_adapter
 
 from kubernetes.client.rest import ApiException
-from kubernetes import client
-from kubernetes.config import (
-    ConfigException,
-    load_incluster_config,
-    load_kube_config
-)
+from kubernetes import client, watch
 
 from csp_billing_adapter.config import Config
 from csp_billing_adapter.exceptions import CSPBillingAdapterException
-from csp_billing_adapter_k8s import __version__
+from csp_billing_adapter_k8s import (
+    __version__,
+    codec,
+    credentials,
+    sqlite_storage,
+    tracing
+)
+from csp_billing_adapter_k8s.archive_index import (
+    archive_digest,
+    build_status_overview,
+    get_indexed_entry,
+    serialize_archive
+)
+from csp_billing_adapter_k8s.payload_budget import (
+    PayloadBudget,
+    base64_size,
+    utf8_size
+)
+from csp_billing_adapter_k8s.usage_buffer import UsageAggregator
+from csp_billing_adapter_k8s.usage_discovery import (
+    DiscoveryCache,
+    UsageResource,
+    find_api_group,
+    find_api_resource,
+    select_version
+)
 
 log = logging.getLogger('CSPBillingAdapter')
 
+# Shared API client used by all hooks. None uses the default client.
+# A client with a custom transport can be set for testing.
+api_client = None
+credential_manager = credentials.CredentialManager()
 namespace = os.environ['ADAPTER_NAMESPACE']
 usage_crd_plural = os.environ.get('USAGE_CRD_PLURAL')
 usage_resource = os.environ.get('USAGE_RESOURCE')
 usage_api_version = os.environ.get('USAGE_API_VERSION')
 usage_api_group = os.environ.get('USAGE_API_GROUP')
+usage_namespace = os.environ.get('USAGE_NAMESPACE', namespace)
+usage_discovery = DiscoveryCache(
+    ttl=float(os.environ.get('USAGE_DISCOVERY_TTL', '3600')),
+    negative_ttl=float(os.environ.get('USAGE_DISCOVERY_NEGATIVE_TTL', '30'))
+)
+storage_backend = os.environ.get('STORAGE_BACKEND', 'k8s')
+storage_mirror_summary = os.environ.get(
+    'STORAGE_MIRROR_SUMMARY', 'true'
+).lower() == 'true'
+usage_watch = os.environ.get('USAGE_WATCH', 'false').lower() == 'true'
+usage_watch_max_age = float(os.environ.get('USAGE_WATCH_MAX_AGE', '600'))
+usage_buffer = UsageAggregator()
+usage_watch_stop = threading.Event()
+payload_budget = PayloadBudget(
+    limit=int(os.environ.get('PAYLOAD_SIZE_LIMIT', '1048576')),
+    warn_ratio=float(os.environ.get('PAYLOAD_WARN_RATIO', '0.8')),
+    compact_ratio=float(os.environ.get('PAYLOAD_COMPACT_RATIO', '0.9'))
+)
+tracing.setup_tracing()
 
 
-def _re_raise_api_exception(error: ApiException):
+def _re_raise_api_exception(error: ApiException, action: str = None):
     try:
-        message = json.loads(error.body)['message']
+        message = codec.loads(error.body)['message']
     except Exception:
         # Unexpected format use error message as is
         message = str(error)
 
-    action = inspect.stack()[1].function.replace('_', ' ')
+    if action is None:
+        action = inspect.stack()[1].function.strip('_').replace('_', ' ')
 
     raise CSPBillingAdapterException(
         f'Failed to {action}. {message}'
     ) from error
 
 
+def _resource_version(resource):
+    """
+    Return the resourceVersion of an API response
+
+    Custom objects are returned as dictionaries and all other
+    objects as models.
+    """
+    if isinstance(resource, dict):
+        version = resource.get('metadata', {}).get('resourceVersion')
+    else:
+        metadata = getattr(resource, 'metadata', None)
+        version = getattr(metadata, 'resource_version', None)
+
+    return version if isinstance(version, str) else None
+
+
+def _call_api(
+    api_instance,
+    operation: str,
+    *args,
+    object_name: str = None,
+    payload_bytes: int = None,
+    **kwargs
+):
+    """
+    Call the API operation in a span
+
+    The span records the object name, payload size, response status
+    and the resourceVersion of the returned object. The bearer token
+    is refreshed if it has rotated and a request rejected as
+    unauthorized is retried once with a refreshed token.
+    """
+    attributes = {
+        'k8s.namespace': namespace,
+        'k8s.object.name': object_name,
+        'payload.bytes': payload_bytes
+    }
+
+    credential_manager.refresh_if_rotated()
+    call = getattr(api_instance, operation)
+
+    with tracing.span(f'k8s.{operation}', attributes) as current:
+        try:
+            try:
+                result = call(*args, **kwargs)
+            except ApiException as error:
+                if error.status != 401 or not credential_manager.refresh():
+                    raise
+
+                with tracing.span('retry', {'retry.reason': 'Unauthorized'}):
+                    result = call(*args, **kwargs)
+        except ApiException as error:
+            current.set_attribute('http.status_code', error.status)
+            current.set_attribute('k8s.status', 'Failure')
+            raise
+
+        current.set_attribute('k8s.status', 'Success')
+        version = _resource_version(result)
+
+        if version:
+            current.set_attribute('k8s.resource_version', version)
+
+        return result
+
+
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def setup_adapter(config: Config):
     """
     Authenticate to k8s cluster
 
     Authentication first tries incluster config for running in a container.
-    Then it will check kube config if running on control plane.
+    Then it will check kube config if running on control plane. The
+    configuration is cached by the credential manager and the shared
+    API client is built from it.
     """
-    try:
-        load_incluster_config()
-        log.info('Loaded in cluster config.')
-    except ConfigException:
-        load_kube_config()
-        log.info('Loaded Kube config.')
+    global api_client
+
+    configuration = credential_manager.load()
+
+    if api_client is None:
+        api_client = client.ApiClient(configuration)
+
+    if usage_watch:
+        _start_usage_watch()
 
 
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def save_cache(config: Config, cache: dict):
     """
     Store the cache as a namespaced opaque secret in k8s cluster
 
     If the cache already exists nothing happens and return None.
     """
-    api_instance = client.CoreV1Api()
+    if storage_backend == 'sqlite':
+        return sqlite_storage.save_cache(config, cache)
+
+    api_instance = client.CoreV1Api(api_client)
+    data = _encode_cache(cache)
 
     secret = client.V1Secret(
         metadata=client.V1ObjectMeta(
             name='csp-adapter-cache',
             namespace=namespace
         ),
-        string_data={'data': json.dumps(cache)},
+        data={'data': data},
         type='Opaque'
     )
 
     try:
-        api_instance.create_namespaced_secret(
+        _call_api(
+            api_instance,
+            'create_namespaced_secret',
             namespace,
-            secret
+            secret,
+            object_name='csp-adapter-cache',
+            payload_bytes=len(data)
         )
     except ApiException as error:
         if error.status == 409:
@@ -113,17 +238,24 @@ def save_cache(config: Config, cache: dict):
 
 
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def get_cache(config: Config):
     """
     Return the namespaced cache from k8s cluster
 
     If it does not exist return None.
     """
-    api_instance = client.CoreV1Api()
+    if storage_backend == 'sqlite':
+        return sqlite_storage.get_cache(config)
+
+    api_instance = client.CoreV1Api(api_client)
     try:
-        resource = api_instance.read_namespaced_secret(
+        resource = _call_api(
+            api_instance,
+            'read_namespaced_secret',
             'csp-adapter-cache',
             namespace,
+            object_name='csp-adapter-cache'
         )
     except ApiException as error:
         if error.status == 404:
@@ -133,10 +265,11 @@ def get_cache(config: Config):
             log.error(f'Failed to load cache: {str(error)}')
             _re_raise_api_exception(error)
     else:
-        return json.loads(base64.b64decode(resource.data.get('data')).decode())
+        return _decode_cache(resource.data.get('data'))
 
 
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def update_cache(config: Config, cache: dict, replace: bool):
     """
     Update the namespace cache secret in k8s cluster
@@ -144,35 +277,83 @@ def update_cache(config: Config, cache: dict, replace: bool):
     If replace is True the cache will be replaced with the provided
     values. Otherwise the cache is updated based on the values provided.
     """
-    api_instance = client.CoreV1Api()
+    if storage_backend == 'sqlite':
+        return sqlite_storage.update_cache(config, cache, replace)
+
+    api_instance = client.CoreV1Api(api_client)
 
     if not replace:
         cache = {**get_cache(config=config), **cache}
 
-    api_instance.patch_namespaced_secret(
+    data = _encode_cache(cache)
+    _call_api(
+        api_instance,
+        'patch_namespaced_secret',
         'csp-adapter-cache',
         namespace,
-        {
-            'data': {
-                'data': base64.b64encode(json.dumps(cache).encode()).decode()
-            }
-        }
+        {'data': {'data': data}},
+        object_name='csp-adapter-cache',
+        payload_bytes=len(data)
     )
 
 
+def _encode_cache(cache: dict) -> str:
+    """
+    Return the base64 encoded cache for the cache secret
+
+    The encoded size is checked against the payload budget. If it has
+    reached the compaction threshold the cache is gzip compressed.
+    """
+    with tracing.span('serialize.cache') as current:
+        data = codec.dumps(cache)
+        compress = payload_budget.should_compact(base64_size(len(data)))
+
+        if compress:
+            log.warning('Cache is near the size limit, compressing cache.')
+            data = gzip.compress(data)
+
+        current.set_attribute('cache.compressed', compress)
+        current.set_attribute('payload.bytes', base64_size(len(data)))
+
+    payload_budget.record('csp-adapter-cache', base64_size(len(data)))
+    return base64.b64encode(data).decode()
+
+
+def _decode_cache(data: str) -> dict:
+    """
+    Return the cache from the base64 encoded cache secret data
+
+    Compressed caches are detected by the gzip magic number which
+    cannot start a JSON document.
+    """
+    with tracing.span('deserialize.cache', {'payload.bytes': len(data)}):
+        data = base64.b64decode(data)
+
+        if data[:2] == b'\x1f\x8b':
+            data = gzip.decompress(data)
+
+        return codec.loads(data)
+
+
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def get_csp_config(config: Config):
     """
     Get the namespaced csp-config config map from k8s cluster
 
     If the config map does not exist return None.
     """
+    if storage_backend == 'sqlite':
+        return sqlite_storage.get_csp_config(config)
 
-    api_instance = client.CoreV1Api()
+    api_instance = client.CoreV1Api(api_client)
     try:
-        resp = api_instance.read_namespaced_config_map(
+        resp = _call_api(
+            api_instance,
+            'read_namespaced_config_map',
             'csp-config',
-            namespace
+            namespace,
+            object_name='csp-config'
         )
     except ApiException as error:
         if error.status == 404:
@@ -182,10 +363,15 @@ def get_csp_config(config: Config):
             log.error('Failed to load CSP Config: {str(error)}')
             _re_raise_api_exception(error)
     else:
-        return json.loads(resp.data.get('data', '{}'))
+        data = resp.data.get('data', '{}')
+        attributes = {'payload.bytes': len(data)}
+
+        with tracing.span('deserialize.csp-config', attributes):
+            return codec.loads(data)
 
 
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def update_csp_config(
     config: Config,
     csp_config: Config,
@@ -197,19 +383,56 @@ def update_csp_config(
     If replace is True replace the config map with values provided.
     Otherwise the existing map is updated using the values provided.
     """
-    api_instance = client.CoreV1Api()
+    if storage_backend == 'sqlite':
+        return sqlite_storage.update_csp_config(config, csp_config, replace)
+
+    api_instance = client.CoreV1Api(api_client)
 
     if not replace:
         csp_config = {**get_csp_config(config=config), **csp_config}
 
-    api_instance.patch_namespaced_config_map(
+    data = _encode_csp_config(csp_config)
+    _call_api(
+        api_instance,
+        'patch_namespaced_config_map',
         'csp-config',
         namespace,
-        {'data': {'data': json.dumps(csp_config)}}
+        {'data': data},
+        object_name='csp-config',
+        payload_bytes=_config_map_size(data)
     )
 
 
+def _encode_csp_config(csp_config: Config) -> dict:
+    """
+    Return the csp-config config map data
+
+    The payload budget report is published in the payload_budget key so
+    it can be read from outside the process. The encoded size of both
+    keys is recorded in the payload budget.
+    """
+    with tracing.span('serialize.csp-config') as current:
+        data = codec.dumps(csp_config)
+        current.set_attribute('payload.bytes', len(data))
+
+    # The size of the report from the previous write is used to estimate
+    # the size of the report that includes this write
+    report = codec.dumps_str(payload_budget.report())
+    payload_budget.record('csp-config', len(data) + utf8_size(report))
+
+    return {
+        'data': data.decode(),
+        'payload_budget': codec.dumps_str(payload_budget.report())
+    }
+
+
+def _config_map_size(data: dict) -> int:
+    """Return the UTF-8 size of the config map data values."""
+    return sum(utf8_size(value) for value in data.values())
+
+
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def save_csp_config(
     config: Config,
     csp_config: Config
@@ -219,9 +442,11 @@ def save_csp_config(
 
     If the config map already exists do nothing and return None.
     """
+    if storage_backend == 'sqlite':
+        return sqlite_storage.save_csp_config(config, csp_config)
 
-    api_instance = client.CoreV1Api()
-    data = {'data': json.dumps(csp_config)}
+    api_instance = client.CoreV1Api(api_client)
+    data = _encode_csp_config(csp_config)
 
     config_map = client.V1ConfigMap(
         data=data,
@@ -232,9 +457,13 @@ def save_csp_config(
     )
 
     try:
-        api_instance.create_namespaced_config_map(
+        _call_api(
+            api_instance,
+            'create_namespaced_config_map',
             namespace,
-            config_map
+            config_map,
+            object_name='csp-config',
+            payload_bytes=_config_map_size(data)
         )
     except ApiException as error:
         if error.status == 409:
@@ -246,11 +475,18 @@ def save_csp_config(
 
 
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def get_usage_data(config: Config):
     """
     Get the usage data from the CRD based on environment variables
 
-    If the CRD is not found raise an Exception to calling scope.
+    If the usage watch is enabled the usage aggregated since the previous
+    call is returned. If the watch has not been healthy within
+    USAGE_WATCH_MAX_AGE seconds the aggregates are discarded and the
+    resource is read directly. The location of the usage resource is resolved
+    using API discovery and cached. If the resource is not found at a
+    cached location it is resolved again and read once more. If the CRD
+    is not found raise an Exception to calling scope.
     """
     if not usage_api_group:
         msg = (
@@ -261,15 +497,6 @@ def get_usage_data(config: Config):
         log.error(msg)
         raise Exception(msg)
 
-    if not usage_api_version:
-        msg = (
-            'Unable to log current usage data. '
-            'Environment variable: "USAGE_API_VERSION" is missing '
-            'and is required to get usage data.'
-        )
-        log.error(msg)
-        raise Exception(msg)
-
     if not usage_crd_plural:
         msg = (
             'Unable to log current usage data. '
@@ -288,15 +515,36 @@ def get_usage_data(config: Config):
         log.error(msg)
         raise Exception(msg)
 
-    api = client.CustomObjectsApi()
+    if usage_watch:
+        if usage_buffer.is_stale(usage_watch_max_age):
+            if usage_buffer.latest is not None:
+                log.warning(
+                    'Usage watch is stale, reading usage resource directly.'
+                )
+
+            usage_buffer.clear()
+        else:
+            usage = usage_buffer.aggregate(config)
+
+            if usage is not None:
+                return usage
+
+    cached = usage_discovery.fresh()
+    location = _resolve_usage_resource()
 
     try:
-        resource = api.get_cluster_custom_object(
-            group=usage_api_group,
-            version=usage_api_version,
-            plural=usage_crd_plural,
-            name=usage_resource,
-        )
+        try:
+            resource = _get_usage_resource(location)
+        except ApiException as error:
+            # Rediscover once unless discovery has just run
+            if error.status != 404 or not cached:
+                raise
+
+            # The CRD may serve a new version or scope after an upgrade
+            location = _resolve_usage_resource(rediscover=True)
+
+            with tracing.span('retry', {'retry.reason': 'NotFound'}):
+                resource = _get_usage_resource(location)
     except ApiException as error:
         if error.status == 404:
             log.error('Usage resource not found.')
@@ -307,39 +555,258 @@ def get_usage_data(config: Config):
             log.error(f'Failed to load usage data: {str(error)}')
             _re_raise_api_exception(error)
 
-    # Sanitize k8s metadata from response.
-    # This leaves only the usage data provided by the product.
-    try:
-        del resource['metadata']
-    except KeyError:
-        pass
+    resource = _sanitize_usage_resource(resource)
 
-    try:
-        del resource['apiVersion']
-    except KeyError:
-        pass
+    if usage_watch:
+        # Seed the buffer so the next interval can be aggregated
+        usage_buffer.record(resource)
+
+    return resource
+
+
+def _get_usage_resource(location: UsageResource) -> dict:
+    """
+    Read the usage resource from the resolved location
+
+    Raise a 404 ApiException if the usage resource could not be
+    resolved.
+    """
+    if location is None:
+        raise ApiException(status=404, reason='Usage resource not served')
+
+    api = client.CustomObjectsApi(api_client)
+
+    if location.namespaced:
+        operation = 'get_namespaced_custom_object'
+    else:
+        operation = 'get_cluster_custom_object'
+
+    return _call_api(
+        api,
+        operation,
+        object_name=location.name,
+        name=location.name,
+        **location.api_kwargs()
+    )
+
+
+def _resolve_usage_resource(rediscover: bool = False):
+    """
+    Return the location of the usage resource
+
+    The cached location is used until it expires or rediscover is
+    set. If discovery fails and USAGE_API_VERSION is set the cluster
+    scoped resource in that version is used. If the API group or
+    resource is not served return None, which is cached for the
+    shorter negative TTL.
+    """
+    if not rediscover and usage_discovery.fresh():
+        return usage_discovery.resource
 
     try:
-        del resource['kind']
-    except KeyError:
-        pass
+        location = _discover_usage_resource()
+    except ApiException as error:
+        if not usage_api_version:
+            log.error(f'Failed to discover usage resource: {str(error)}')
+            _re_raise_api_exception(error)
+
+        log.warning(
+            f'Usage resource discovery failed, using version '
+            f'{usage_api_version}: {str(error)}'
+        )
+        location = UsageResource(
+            usage_api_group,
+            usage_api_version,
+            usage_crd_plural,
+            usage_resource
+        )
+
+    usage_discovery.set(location)
+    return location
+
+
+def _discover_usage_resource():
+    """
+    Discover the version and scope of the usage resource
+
+    USAGE_API_VERSION is used if it is served, otherwise the preferred
+    version of the API group. Return None if the API group or the
+    resource is not served.
+    """
+    with tracing.span('discover.usage_resource') as current:
+        group_list = _call_api(client.ApisApi(api_client), 'get_api_versions')
+        api_group = find_api_group(group_list, usage_api_group)
+
+        if api_group is None:
+            log.error(f'Usage API group {usage_api_group} is not served.')
+            return None
+
+        version = select_version(api_group, usage_api_version)
+        resource_list = _call_api(
+            client.CustomObjectsApi(api_client),
+            'get_api_resources',
+            usage_api_group,
+            version
+        )
+        api_resource = find_api_resource(resource_list, usage_crd_plural)
+
+        if api_resource is None:
+            log.error(
+                f'Usage resource {usage_crd_plural} is not served in '
+                f'{usage_api_group}/{version}.'
+            )
+            return None
+
+        current.set_attribute('k8s.api_version', version)
+        current.set_attribute('k8s.namespaced', api_resource.namespaced)
+
+    log.info(
+        f'Resolved usage resource {usage_crd_plural}.{usage_api_group}/'
+        f'{version}, namespaced: {api_resource.namespaced}.'
+    )
+    return UsageResource(
+        usage_api_group,
+        version,
+        usage_crd_plural,
+        usage_resource,
+        namespace=usage_namespace if api_resource.namespaced else None,
+        served_versions=tuple(
+            served.version for served in api_group.versions
+        )
+    )
+
+
+def _sanitize_usage_resource(resource: dict):
+    """
+    Sanitize k8s metadata from the usage resource
+
+    This leaves only the usage data provided by the product.
+    """
+    for key in ('metadata', 'apiVersion', 'kind'):
+        resource.pop(key, None)
 
     return resource
 
 
+def _start_usage_watch():
+    """
+    Start recording changes to the usage resource in a background thread
+    """
+    if not all((usage_api_group, usage_crd_plural, usage_resource)):
+        log.warning(
+            'Usage watch disabled. The usage resource environment '
+            'variables are required to watch usage data.'
+        )
+        return None
+
+    usage_watch_stop.clear()
+    thread = threading.Thread(
+        target=_watch_usage,
+        name='usage-watch',
+        daemon=True
+    )
+    thread.start()
+    log.info('Started usage watch.')
+
+
+def _watch_usage():
+    """
+    Record every change to the usage resource in the usage buffer
+
+    The usage buffer is cleared when the resource is deleted and marked
+    healthy on every event and when a stream ends cleanly. The watch is
+    restarted when the stream ends or fails until
+    usage_watch_stop is set. If the resource version has expired
+    the watch starts again from the current state of the resource.
+    The usage resource location is resolved again if it is not found.
+    The bearer token is refreshed if it has rotated or the watch is
+    rejected as unauthorized.
+    """
+    api = client.CustomObjectsApi(api_client)
+    resource_version = None
+
+    while not usage_watch_stop.is_set():
+        credential_manager.refresh_if_rotated()
+        location = None
+
+        try:
+            location = _resolve_usage_resource()
+
+            if location is None:
+                raise ApiException(
+                    status=404,
+                    reason='Usage resource not served'
+                )
+
+            if location.namespaced:
+                list_objects = api.list_namespaced_custom_object
+            else:
+                list_objects = api.list_cluster_custom_object
+
+            stream = watch.Watch().stream(
+                list_objects,
+                field_selector=f'metadata.name={location.name}',
+                resource_version=resource_version,
+                timeout_seconds=300,
+                **location.api_kwargs()
+            )
+
+            for event in stream:
+                if event['type'] == 'ERROR':
+                    resource_version = None
+                    break
+
+                resource = event['object']
+                resource_version = resource.get('metadata', {}).get(
+                    'resourceVersion'
+                )
+
+                if event['type'] in ('ADDED', 'MODIFIED'):
+                    usage_buffer.record(_sanitize_usage_resource(resource))
+                elif event['type'] == 'DELETED':
+                    log.warning('Usage resource deleted.')
+                    usage_buffer.clear()
+
+                usage_buffer.touch()
+
+                if usage_watch_stop.is_set():
+                    break
+            else:
+                # Stream timed out without errors
+                usage_buffer.touch()
+        except Exception as error:
+            if isinstance(error, ApiException) and error.status == 410:
+                resource_version = None
+            elif isinstance(error, ApiException) and error.status == 401:
+                credential_manager.refresh()
+            elif isinstance(error, ApiException) and error.status == 404:
+                if location is not None:
+                    # Rediscover a location that is no longer served
+                    usage_discovery.invalidate()
+
+            log.warning(f'Usage watch failed: {str(error)}')
+            usage_watch_stop.wait(5)
+
+
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def get_metering_archive(config: Config):
     """
     Get the namespaced metering-archive config map from k8s cluster
 
     If the config map does not exist return an empty list.
     """
+    if storage_backend == 'sqlite':
+        return sqlite_storage.get_metering_archive(config)
 
-    api_instance = client.CoreV1Api()
+    api_instance = client.CoreV1Api(api_client)
     try:
-        resp = api_instance.read_namespaced_config_map(
+        resp = _call_api(
+            api_instance,
+            'read_namespaced_config_map',
             'metering-archive',
-            namespace
+            namespace,
+            object_name='metering-archive'
         )
     except ApiException as error:
         if error.status == 404:
@@ -349,10 +816,14 @@ def get_metering_archive(config: Config):
             log.error('Failed to load archive: {str(error)}')
             _re_raise_api_exception(error)
     else:
-        return json.loads(resp.data.get('archive', '[]'))
+        data = resp.data.get('archive', '[]')
+
+        with tracing.span('deserialize.archive', {'payload.bytes': len(data)}):
+            return codec.loads(_decode_archive_text(data))
 
 
 @csp_billing_adapter.hookimpl
+@tracing.traced
 def save_metering_archive(
     config: Config,
     archive_data: list
@@ -360,40 +831,271 @@ def save_metering_archive(
     """
     Save the namespaced metering-archive config map in k8s cluster
 
-    If the config map does not exist it is created, Otherwise the
+    The archive index is saved to the metering-archive-index config map.
+    If a config map does not exist it is created, Otherwise the
     existing config map is updated using the values provided.
     """
-    archive = get_metering_archive(config=config)
-    api_instance = client.CoreV1Api()
-    data = {'archive': json.dumps(archive_data)}
+    if storage_backend == 'sqlite':
+        sqlite_storage.save_metering_archive(config, archive_data)
+
+        if storage_mirror_summary:
+            _save_archive_summary(sqlite_storage.get_archive_summary(config))
 
-    if archive:
-        api_instance.patch_namespaced_config_map(
+        return None
+
+    with tracing.span('serialize.archive') as current:
+        serialized_archive, index = serialize_archive(archive_data)
+        archive, archive_bytes = _encode_archive_text(
             'metering-archive',
+            serialized_archive
+        )
+        serialized_index, index_bytes = _encode_archive_text(
+            'metering-archive-index',
+            codec.dumps_str(index)
+        )
+        index_data = {
+            'index': serialized_index,
+            'archive_digest': archive_digest(serialized_archive)
+        }
+        current.set_attribute('archive.entries', len(index))
+        current.set_attribute('payload.bytes', archive_bytes + index_bytes)
+
+    # The index is written last, readers check it against the archive digest
+    _save_config_map('metering-archive', {'archive': archive}, archive_bytes)
+    _save_config_map('metering-archive-index', index_data, index_bytes)
+
+
+def _encode_archive_text(name: str, text: str) -> (str, int):
+    """
+    Return the config map value for the archive or index text and its size
+
+    The UTF-8 size is checked against the payload budget. If it has
+    reached the compaction threshold the text is gzip compressed and
+    base64 encoded. No entries are dropped.
+    """
+    size = utf8_size(text)
+    compress = payload_budget.should_compact(size)
+
+    if compress:
+        log.warning(f'{name} is near the size limit, compressing {name}.')
+        text = base64.b64encode(gzip.compress(text.encode())).decode()
+        size = len(text)
+
+    payload_budget.record(name, size)
+    return text, size
+
+
+def _decode_archive_text(text: str) -> str:
+    """
+    Return the archive or index text from the config map value
+
+    Compressed values are detected by the first character since base64
+    cannot start with the opening bracket or brace of a JSON document.
+    """
+    if text[:1] in ('[', '{', ''):
+        return text
+
+    return gzip.decompress(base64.b64decode(text)).decode()
+
+
+def _save_config_map(name: str, data: dict, payload_bytes: int):
+    """
+    Update the namespaced config map with the data or create it
+
+    Keys of an existing config map that are not in data are kept. If
+    the config map is created after the update fails the update is
+    retried.
+    """
+    api_instance = client.CoreV1Api(api_client)
+
+    try:
+        _call_api(
+            api_instance,
+            'patch_namespaced_config_map',
+            name,
             namespace,
-            {'data': data}
+            {'data': data},
+            object_name=name,
+            payload_bytes=payload_bytes
         )
+    except ApiException as error:
+        if error.status != 404:
+            log.error(f'Failed to save {name}: {str(error)}')
+            _re_raise_api_exception(error, _config_map_action('save', name))
     else:
-        config_map = client.V1ConfigMap(
-            data=data,
-            metadata=client.V1ObjectMeta(
-                name='metering-archive',
-                namespace=namespace
-            )
+        return None
+
+    config_map = client.V1ConfigMap(
+        data=data,
+        metadata=client.V1ObjectMeta(
+            name=name,
+            namespace=namespace
         )
+    )
 
-        try:
-            api_instance.create_namespaced_config_map(
+    try:
+        _call_api(
+            api_instance,
+            'create_namespaced_config_map',
+            namespace,
+            config_map,
+            object_name=name,
+            payload_bytes=payload_bytes
+        )
+    except ApiException as error:
+        if error.status != 409:
+            log.error(f'Failed to save {name}: {str(error)}')
+            _re_raise_api_exception(error, _config_map_action('save', name))
+
+        # Created since it was patched, retry the patch
+        with tracing.span('retry', {'retry.reason': 'AlreadyExists'}):
+            _call_api(
+                api_instance,
+                'patch_namespaced_config_map',
+                name,
                 namespace,
-                config_map
+                {'data': data},
+                object_name=name,
+                payload_bytes=payload_bytes
             )
-        except ApiException as error:
-            log.error(f'Failed to save archive: {str(error)}')
-            _re_raise_api_exception(error)
+
+
+def _config_map_action(verb: str, name: str) -> str:
+    """Return the action of an error message for the named config map."""
+    return f'{verb} {name.replace("-", " ")}'
+
+
+def _read_config_map(name: str):
+    """
+    Return the data of the namespaced config map
+
+    If the config map does not exist return None.
+    """
+    api_instance = client.CoreV1Api(api_client)
+    try:
+        resp = _call_api(
+            api_instance,
+            'read_namespaced_config_map',
+            name,
+            namespace,
+            object_name=name
+        )
+    except ApiException as error:
+        if error.status == 404:
+            log.info(f'No existing {name}.')
+            return None
+        else:
+            log.error(f'Failed to load {name}: {str(error)}')
+            _re_raise_api_exception(error, _config_map_action('read', name))
+    else:
+        return resp.data or {}
+
+
+def get_archive_entry(config: Config, billing_time: str):
+    """
+    Return the metering archive entry for the provided billing time
+
+    The metering-archive-index config map is read first. If its digest
+    matches the archive only the indexed entry is parsed. If there is
+    no index, the index is stale or the indexed slice does not hold
+    the entry the full archive is searched. If there is no entry for
+    the billing time return None.
+    """
+    if storage_backend == 'sqlite':
+        return sqlite_storage.get_archive_entry(config, billing_time)
+
+    index_data = _read_config_map('metering-archive-index')
+    data = _read_config_map('metering-archive')
+
+    if not data:
+        return None
+
+    archive = _decode_archive_text(data.get('archive', '[]'))
+
+    if (
+        index_data
+        and 'index' in index_data
+        and index_data.get('archive_digest') == archive_digest(archive)
+    ):
+        index = codec.loads(_decode_archive_text(index_data['index']))
+
+        if billing_time not in index:
+            return None
+
+        entry = get_indexed_entry(archive, index, billing_time)
+
+        if entry is not None:
+            return entry
+
+    for entry in reversed(codec.loads(archive)):
+        if entry.get('billing_time') == billing_time:
+            return entry
+
+    return None
+
+
+def get_archive_status(config: Config):
+    """
+    Return the billing status of each metering archive entry
+
+    The result maps billing_time to a dictionary of dimension to
+    status. It is read from the metering-archive-index config map
+    without reading the archive. If there is no index the archive is
+    read instead.
+    """
+    if storage_backend == 'sqlite':
+        return sqlite_storage.get_archive_status(config)
+
+    index_data = _read_config_map('metering-archive-index')
+
+    if index_data and 'index' in index_data:
+        return {
+            billing_time: location['billing_status']
+            for billing_time, location in codec.loads(
+                _decode_archive_text(index_data['index'])
+            ).items()
+        }
+
+    data = _read_config_map('metering-archive')
+
+    if not data:
+        return {}
+
+    return build_status_overview(
+        codec.loads(_decode_archive_text(data.get('archive', '[]')))
+    )
+
+
+def _save_archive_summary(summary: dict):
+    """
+    Mirror a summary of the local archive to the metering-archive config map
+
+    This keeps tooling that reads the archive location working when
+    the archive itself is stored in the local database.
+    """
+    data = {'summary': codec.dumps_str(summary)}
+    _save_config_map('metering-archive', data, utf8_size(data['summary']))
+
+
+def get_payload_budget():
+    """
+    Return the size budget status of each object written by the plugin
+
+    The result maps the object name to the last written size, the
+    ratio of the size limit used, the growth per write and the
+    projected number of writes until the limit is reached. This is
+    the state of the current process, the payload_budget key of the
+    csp-config config map holds the report as of the last csp-config
+    write.
+    """
+    return payload_budget.report()
 
 
 @csp_billing_adapter.hookimpl
 def get_archive_location():
+    if storage_backend == 'sqlite' and not storage_mirror_summary:
+        return sqlite_storage.db_path
+
     return 'metering-archive'
 
 
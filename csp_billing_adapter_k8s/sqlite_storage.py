@@ -0,0 +1,423 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Local SQLite storage backend for the cache, csp-config and metering archive.
+
+The database lives on a mounted volume, the location is determined by the
+STORAGE_DB_PATH environment variable. The functions mirror the storage hook
+implementations in the plugin module and are dispatched to when the
+STORAGE_BACKEND environment variable is set to "sqlite".
+
+A single connection is opened and the schema is created on first use.
+The connection is shared by all calls and guarded by a lock.
+"""
+
+import inspect
+import logging
+import os
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+
+from csp_billing_adapter.config import Config
+from csp_billing_adapter.exceptions import CSPBillingAdapterException
+from csp_billing_adapter_k8s import codec
+from csp_billing_adapter_k8s.archive_index import summarize_billing_status
+
+log = logging.getLogger('CSPBillingAdapter')
+
+db_path = os.environ.get(
+    'STORAGE_DB_PATH',
+    '/var/lib/csp-billing-adapter/adapter.db'
+)
+
+connection = None
+connection_path = None
+connection_lock = threading.RLock()
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    '  id INTEGER PRIMARY KEY CHECK (id = 1),'
+    '  data TEXT NOT NULL'
+    ')',
+    'CREATE TABLE IF NOT EXISTS csp_config ('
+    '  id INTEGER PRIMARY KEY CHECK (id = 1),'
+    '  data TEXT NOT NULL'
+    ')',
+    'CREATE TABLE IF NOT EXISTS metering_archive ('
+    '  position INTEGER PRIMARY KEY,'
+    '  billing_time TEXT,'
+    '  entry TEXT NOT NULL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS metering_archive_billing_time '
+    'ON metering_archive (billing_time)',
+)
+
+
+def _re_raise_sqlite_error(error: sqlite3.Error):
+    action = inspect.stack()[1].function.replace('_', ' ')
+
+    raise CSPBillingAdapterException(
+        f'Failed to {action}. {str(error)}'
+    ) from error
+
+
+def _open_connection():
+    """
+    Open a connection to the storage database and create the schema
+
+    The connection is in autocommit mode, transactions are started
+    explicitly using _transaction. WAL mode allows readers to
+    proceed while a write is in progress.
+    """
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(
+        db_path,
+        isolation_level=None,
+        timeout=30,
+        check_same_thread=False
+    )
+
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+
+        for statement in SCHEMA:
+            conn.execute(statement)
+    except sqlite3.Error:
+        conn.close()
+        raise
+
+    return conn
+
+
+@contextmanager
+def _connect():
+    """
+    Provide the shared connection to the storage database
+
+    The connection is opened on first use and again if db_path has
+    changed. It is closed after an error so the next call starts with
+    a new connection.
+    """
+    global connection, connection_path
+
+    with connection_lock:
+        if connection is None or connection_path != db_path:
+            close()
+            connection = _open_connection()
+            connection_path = db_path
+
+        try:
+            yield connection
+        except sqlite3.Error:
+            close()
+            raise
+
+
+def close():
+    """Close the shared connection if it is open."""
+    global connection, connection_path
+
+    with connection_lock:
+        if connection is not None:
+            connection.close()
+
+        connection = None
+        connection_path = None
+
+
+@contextmanager
+def _transaction(conn):
+    """
+    Run the enclosed statements in a single write transaction
+
+    BEGIN IMMEDIATE takes the write lock up front so read-modify-write
+    updates cannot interleave with another writer.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        conn.execute('COMMIT')
+
+
+def _read_document(conn, table: str):
+    row = conn.execute(f'SELECT data FROM {table} WHERE id = 1').fetchone()
+    return codec.loads(row[0]) if row else None
+
+
+def _write_document(conn, table: str, data: dict):
+    conn.execute(
+        f'INSERT OR REPLACE INTO {table} (id, data) VALUES (1, ?)',
+        (codec.dumps_str(data),)
+    )
+
+
+def save_cache(config: Config, cache: dict):
+    """
+    Store the cache in the database
+
+    If the cache already exists nothing happens and return None.
+    """
+    try:
+        with _connect() as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO cache (id, data) VALUES (1, ?)',
+                (codec.dumps_str(cache),)
+            )
+    except sqlite3.Error as error:
+        log.error(f'Failed to save cache: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+    if not cursor.rowcount:
+        log.info('Cache already exists.')
+
+
+def get_cache(config: Config):
+    """
+    Return the cache from the database
+
+    If it does not exist return None.
+    """
+    try:
+        with _connect() as conn:
+            cache = _read_document(conn, 'cache')
+    except sqlite3.Error as error:
+        log.error(f'Failed to load cache: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+    if cache is None:
+        log.info('No existing cache found.')
+
+    return cache
+
+
+def update_cache(config: Config, cache: dict, replace: bool):
+    """
+    Update the cache in the database
+
+    If replace is True the cache will be replaced with the provided
+    values. Otherwise the cache is updated based on the values provided.
+    The read and write happen in a single transaction.
+    """
+    try:
+        with _connect() as conn, _transaction(conn):
+            if not replace:
+                cache = {**(_read_document(conn, 'cache') or {}), **cache}
+
+            _write_document(conn, 'cache', cache)
+    except sqlite3.Error as error:
+        log.error(f'Failed to update cache: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+
+def get_csp_config(config: Config):
+    """
+    Get the csp-config from the database
+
+    If the csp-config does not exist return None.
+    """
+    try:
+        with _connect() as conn:
+            csp_config = _read_document(conn, 'csp_config')
+    except sqlite3.Error as error:
+        log.error(f'Failed to load CSP Config: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+    if csp_config is None:
+        log.info('No existing CSP Config.')
+
+    return csp_config
+
+
+def update_csp_config(config: Config, csp_config: Config, replace: bool):
+    """
+    Update the csp-config in the database
+
+    If replace is True replace the csp-config with values provided.
+    Otherwise the existing csp-config is updated using the values provided.
+    """
+    try:
+        with _connect() as conn, _transaction(conn):
+            if not replace:
+                csp_config = {
+                    **(_read_document(conn, 'csp_config') or {}),
+                    **csp_config
+                }
+
+            _write_document(conn, 'csp_config', csp_config)
+    except sqlite3.Error as error:
+        log.error(f'Failed to update CSP Config: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+
+def save_csp_config(config: Config, csp_config: Config):
+    """
+    Save the csp-config to the database
+
+    If the csp-config already exists do nothing and return None.
+    """
+    try:
+        with _connect() as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO csp_config (id, data) VALUES (1, ?)',
+                (codec.dumps_str(csp_config),)
+            )
+    except sqlite3.Error as error:
+        log.error(f'Failed to save CSP Config: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+    if not cursor.rowcount:
+        log.info('CSP Config already exists.')
+
+
+def get_metering_archive(config: Config):
+    """
+    Get the metering archive from the database
+
+    If the archive is empty return an empty list.
+    """
+    try:
+        with _connect() as conn:
+            rows = conn.execute(
+                'SELECT entry FROM metering_archive ORDER BY position'
+            ).fetchall()
+    except sqlite3.Error as error:
+        log.error(f'Failed to load archive: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+    if not rows:
+        log.info('No existing archive.')
+
+    return [codec.loads(row[0]) for row in rows]
+
+
+def save_metering_archive(config: Config, archive_data: list):
+    """
+    Save the metering archive in the database
+
+    The stored archive is replaced by the provided entries in a
+    single transaction. Only entries that are new or changed at their
+    position are written and positions past the end are deleted.
+    """
+    try:
+        with _connect() as conn, _transaction(conn):
+            stored = dict(
+                conn.execute('SELECT position, entry FROM metering_archive')
+            )
+            rows = []
+
+            for position, entry in enumerate(archive_data):
+                encoded = codec.dumps_str(entry)
+
+                if stored.get(position) != encoded:
+                    rows.append((position, entry.get('billing_time'), encoded))
+
+            conn.executemany(
+                'INSERT OR REPLACE INTO metering_archive '
+                '(position, billing_time, entry) VALUES (?, ?, ?)',
+                rows
+            )
+            conn.execute(
+                'DELETE FROM metering_archive WHERE position >= ?',
+                (len(archive_data),)
+            )
+    except sqlite3.Error as error:
+        log.error(f'Failed to save archive: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+
+def get_archive_entry(config: Config, billing_time: str):
+    """
+    Return the archive entry for the provided billing time
+
+    The lookup uses the billing_time index. If there is no entry
+    for the billing time return None.
+    """
+    try:
+        with _connect() as conn:
+            row = conn.execute(
+                'SELECT entry FROM metering_archive '
+                'WHERE billing_time = ? ORDER BY position DESC LIMIT 1',
+                (billing_time,)
+            ).fetchone()
+    except sqlite3.Error as error:
+        log.error(f'Failed to load archive entry: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+    return codec.loads(row[0]) if row else None
+
+
+def get_archive_status(config: Config):
+    """
+    Return the billing status of each stored archive entry
+
+    The result maps billing_time to a dictionary of dimension to status.
+    Only the billing_status of each entry is extracted and parsed.
+    """
+    try:
+        with _connect() as conn:
+            rows = conn.execute(
+                'SELECT billing_time, '
+                "json_extract(entry, '$.billing_status') "
+                'FROM metering_archive '
+                'WHERE billing_time IS NOT NULL ORDER BY position'
+            ).fetchall()
+    except sqlite3.Error as error:
+        log.error(f'Failed to load archive status: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+    return {
+        billing_time: summarize_billing_status(
+            {'billing_status': codec.loads(status) if status else {}}
+        )
+        for billing_time, status in rows
+    }
+
+
+def get_archive_summary(config: Config):
+    """
+    Return a small summary of the stored metering archive
+
+    The summary contains the number of entries and the first and
+    last billing times.
+    """
+    try:
+        with _connect() as conn:
+            entries, first, last = conn.execute(
+                'SELECT COUNT(*), MIN(billing_time), MAX(billing_time) '
+                'FROM metering_archive'
+            ).fetchone()
+    except sqlite3.Error as error:
+        log.error(f'Failed to load archive summary: {str(error)}')
+        _re_raise_sqlite_error(error)
+
+    return {
+        'backend': 'sqlite',
+        'location': db_path,
+        'entries': entries,
+        'first_billing_time': first,
+        'last_billing_time': last
+    }
@@ -0,0 +1,179 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Optional OpenTelemetry tracing for the plugin hooks.
+
+Tracing is enabled by setting the TRACING_EXPORTER environment variable
+and requires the opentelemetry-sdk package. When tracing is not enabled
+spans are no-ops. The exporter is one of "console", "file", "otlp" or
+the import path of a SpanExporter class in the form "module:Class".
+"""
+
+import functools
+import importlib
+import logging
+import os
+
+from contextlib import contextmanager
+
+try:
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        ConsoleSpanExporter,
+        SimpleSpanProcessor,
+        SpanExporter,
+        SpanExportResult
+    )
+except ImportError:  # pragma: no cover
+    TracerProvider = None
+    SpanExporter = object
+
+log = logging.getLogger('CSPBillingAdapter')
+
+tracer = None
+
+
+class FileSpanExporter(SpanExporter):
+    """Export finished spans as JSON lines appended to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans):
+        with open(self.path, 'a') as trace_file:
+            for span in spans:
+                trace_file.write(span.to_json(indent=None) + '\n')
+
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000):
+        return True
+
+
+def _create_exporter(name: str):
+    """
+    Return the exporter for the TRACING_EXPORTER value
+
+    If the exporter cannot be imported return None.
+    """
+    if name == 'console':
+        return ConsoleSpanExporter()
+    elif name == 'file':
+        return FileSpanExporter(
+            os.environ.get('TRACING_FILE', 'csp-adapter-traces.jsonl')
+        )
+
+    try:
+        if name == 'otlp':
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter
+            )
+            return OTLPSpanExporter()
+
+        module_name, _, class_name = name.partition(':')
+        return getattr(importlib.import_module(module_name), class_name)()
+    except (ImportError, AttributeError, ValueError) as error:
+        log.warning(
+            f'Tracing disabled. Unable to load the {name} exporter: '
+            f'{str(error)}'
+        )
+        return None
+
+
+def setup_tracing(exporter=None):
+    """
+    Configure the tracer from the TRACING_EXPORTER environment variable
+
+    An exporter instance can be provided instead. If tracing is not
+    configured, opentelemetry-sdk is not installed or the exporter
+    cannot be loaded spans are no-ops.
+    """
+    global tracer
+
+    name = os.environ.get('TRACING_EXPORTER')
+
+    if exporter is None and not name:
+        return None
+
+    if TracerProvider is None:
+        log.warning(
+            'Tracing disabled. The opentelemetry-sdk package is required '
+            'for tracing.'
+        )
+        return None
+
+    if exporter is None:
+        exporter = _create_exporter(name)
+
+        if exporter is None:
+            return None
+
+    if isinstance(exporter, (ConsoleSpanExporter, FileSpanExporter)):
+        processor = SimpleSpanProcessor(exporter)
+    else:
+        processor = BatchSpanProcessor(exporter)
+
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': 'csp-billing-adapter-k8s'})
+    )
+    provider.add_span_processor(processor)
+    tracer = provider.get_tracer('csp_billing_adapter_k8s')
+    log.info(f'Tracing enabled using {type(exporter).__name__}.')
+    return provider
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+_noop_span = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, attributes: dict = None):
+    """
+    Start a span as a child of the current span
+
+    Attributes with a value of None are not set. If an exception is
+    raised it is recorded and the span status is set to error.
+    """
+    if tracer is None:
+        yield _noop_span
+        return
+
+    with tracer.start_as_current_span(name) as current:
+        for key, value in (attributes or {}).items():
+            if value is not None:
+                current.set_attribute(key, value)
+
+        yield current
+
+
+def traced(func):
+    """Run the decorated hook in a span named after the hook."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(f'hook.{func.__name__}'):
+            return func(*args, **kwargs)
+
+    return wrapper
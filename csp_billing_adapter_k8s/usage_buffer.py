@@ -0,0 +1,206 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Incremental aggregation of changes to the usage resource.
+
+Running aggregates for each usage metric are updated as changes arrive
+so the usage for a query interval is available without storing the
+individual changes. The time the watch was last known to be healthy is
+tracked so stale aggregates are not used.
+"""
+
+import math
+import threading
+import time
+
+from csp_billing_adapter.config import Config
+
+
+class MetricAggregate:
+    """
+    Running aggregate of one usage metric over the current interval
+
+    The time-weighted total is the integral of the metric value over
+    time up to the most recent sample.
+    """
+
+    __slots__ = (
+        'start_time',
+        'last_time',
+        'last_value',
+        'count',
+        'total',
+        'maximum',
+        'weighted_total'
+    )
+
+    def __init__(self, timestamp: float, value):
+        self.start_time = timestamp
+        self.last_time = timestamp
+        self.last_value = value
+        self.count = 1
+        self.total = value
+        self.maximum = value
+        self.weighted_total = 0
+
+    def add(self, timestamp: float, value):
+        if timestamp > self.last_time:
+            self.weighted_total += (
+                self.last_value * (timestamp - self.last_time)
+            )
+            self.last_time = timestamp
+
+        self.last_value = value
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def mean(self):
+        return self.total / self.count
+
+    def time_weighted_mean(self, now: float):
+        """
+        Return the mean value weighted by how long each value was held
+
+        The most recent value is assumed to hold until now.
+        """
+        now = max(now, self.last_time)
+        duration = now - self.start_time
+
+        if duration <= 0:
+            return self.last_value
+
+        weighted_total = (
+            self.weighted_total + self.last_value * (now - self.last_time)
+        )
+        return weighted_total / duration
+
+
+class UsageAggregator:
+    """
+    Running aggregates of the usage for the current query interval
+
+    Memory use is constant in the number of changes recorded.
+
+    :param clock: Monotonic clock function used for the watch health.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.changes = 0
+        self.aggregates = {}
+        self.latest = None
+        self.clock = clock
+        self.last_update = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of changes recorded in the interval."""
+        return self.changes
+
+    def record(self, usage: dict, timestamp: float = None):
+        """
+        Record a change to the usage resource
+
+        Numeric fields are treated as usage metrics. The remaining
+        fields of the most recent sample are kept to be returned
+        with the aggregates.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        values = {
+            key: value for key, value in usage.items()
+            if isinstance(value, (int, float))
+            and not isinstance(value, bool)
+        }
+
+        with self.lock:
+            self.changes += 1
+            self.latest = usage
+
+            for metric, value in values.items():
+                aggregate = self.aggregates.get(metric)
+
+                if aggregate is None:
+                    self.aggregates[metric] = MetricAggregate(
+                        timestamp,
+                        value
+                    )
+                else:
+                    aggregate.add(timestamp, value)
+
+    def clear(self):
+        """Discard the aggregates, for example when the resource is deleted."""
+        with self.lock:
+            self.changes = 0
+            self.aggregates = {}
+            self.latest = None
+
+    def touch(self):
+        """Record that the watch received an event or ended cleanly."""
+        self.last_update = self.clock()
+
+    def is_stale(self, max_age: float) -> bool:
+        """
+        Return True if the watch has not been healthy for max_age seconds
+
+        An aggregator that has never been touched is stale.
+        """
+        return (
+            self.last_update is None
+            or self.clock() - self.last_update > max_age
+        )
+
+    def aggregate(self, config: Config, now: float = None) -> dict:
+        """
+        Return the usage for the current interval and start a new one
+
+        Each metric in the adapter config is aggregated based on the
+        configured usage_aggregation. Average usage is the time-weighted
+        mean over the interval, rounded up. Maximum usage is the largest
+        value seen in the interval. The new interval starts with the
+        most recent value of each metric.
+        """
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            if self.latest is None:
+                return None
+
+            usage = dict(self.latest)
+
+            for metric, data in config.usage_metrics.items():
+                aggregate = self.aggregates.get(metric)
+
+                if aggregate is None:
+                    continue
+
+                if data['usage_aggregation'] == 'maximum':
+                    usage[metric] = aggregate.maximum
+                else:
+                    usage[metric] = math.ceil(
+                        aggregate.time_weighted_mean(now)
+                    )
+
+            self.aggregates = {
+                metric: MetricAggregate(now, aggregate.last_value)
+                for metric, aggregate in self.aggregates.items()
+            }
+            self.changes = 0
+
+        return usage
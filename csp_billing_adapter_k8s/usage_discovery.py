@@ -0,0 +1,173 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Resolution of the usage custom resource through API discovery.
+
+The API group discovery document provides the preferred and served
+versions of the usage CRD and the resource list of a version provides
+its scope. The resolved location is cached for a TTL so discovery is
+not repeated on every billing cycle.
+"""
+
+import logging
+import time
+
+log = logging.getLogger('CSPBillingAdapter')
+
+
+class UsageResource:
+    """
+    Location of the usage custom resource
+
+    :param namespace:
+        The namespace of the resource or None if it is cluster scoped.
+    :param served_versions: The versions served for the API group.
+    """
+
+    __slots__ = (
+        'group',
+        'version',
+        'plural',
+        'name',
+        'namespace',
+        'served_versions'
+    )
+
+    def __init__(
+        self,
+        group: str,
+        version: str,
+        plural: str,
+        name: str,
+        namespace: str = None,
+        served_versions: tuple = ()
+    ):
+        self.group = group
+        self.version = version
+        self.plural = plural
+        self.name = name
+        self.namespace = namespace
+        self.served_versions = served_versions
+
+    @property
+    def namespaced(self) -> bool:
+        return self.namespace is not None
+
+    def api_kwargs(self) -> dict:
+        """
+        Return the arguments for CustomObjectsApi calls
+
+        The name is not included so the arguments can be used for
+        list and watch calls.
+        """
+        kwargs = {
+            'group': self.group,
+            'version': self.version,
+            'plural': self.plural
+        }
+
+        if self.namespaced:
+            kwargs['namespace'] = self.namespace
+
+        return kwargs
+
+
+def find_api_group(group_list, name: str):
+    """
+    Return the group from a V1APIGroupList with the provided name
+
+    If the group is not served return None.
+    """
+    for api_group in group_list.groups or []:
+        if api_group.name == name:
+            return api_group
+
+    return None
+
+
+def select_version(api_group, pinned_version: str = None) -> str:
+    """
+    Return the version of the API group to use
+
+    The pinned version is used if it is served, otherwise the
+    preferred version of the group is used.
+    """
+    served = [version.version for version in api_group.versions]
+
+    if pinned_version in served:
+        return pinned_version
+    elif pinned_version:
+        log.warning(
+            f'Usage API version {pinned_version} is not served, using '
+            f'preferred version {api_group.preferred_version.version}. '
+            f'Served versions: {", ".join(served)}.'
+        )
+
+    return api_group.preferred_version.version
+
+
+def find_api_resource(resource_list, plural: str):
+    """
+    Return the resource from a V1APIResourceList with the plural name
+
+    If the resource is not served return None.
+    """
+    for api_resource in resource_list.resources or []:
+        if api_resource.name == plural:
+            return api_resource
+
+    return None
+
+
+class DiscoveryCache:
+    """
+    Cache of the resolved usage resource with a time to live
+
+    A resource that is not served is cached as None for the shorter
+    negative_ttl so a CRD that is served again, for example after an
+    upgrade, is found soon after.
+
+    :param ttl: Seconds the resolved resource is used before expiring.
+    :param negative_ttl:
+        Seconds a resource that is not served is cached. Defaults to ttl.
+    :param clock: Monotonic clock function returning seconds.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        negative_ttl: float = None,
+        clock=time.monotonic
+    ):
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.clock = clock
+        self.resource = None
+        self.expires = None
+
+    def fresh(self) -> bool:
+        """Return True if the cached entry has not expired."""
+        return self.expires is not None and self.clock() < self.expires
+
+    def set(self, resource: UsageResource):
+        ttl = self.ttl if resource is not None else self.negative_ttl
+        self.resource = resource
+        self.expires = self.clock() + ttl
+
+    def invalidate(self):
+        self.resource = None
+        self.expires = None
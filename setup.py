@@ -57,7 +57,12 @@ setup(
     install_requires=requirements,
     extras_require={
         'dev': dev_requirements,
-        'test': test_requirements
+        'test': test_requirements,
+        'orjson': ['orjson'],
+        'tracing': [
+            'opentelemetry-sdk',
+            'opentelemetry-exporter-otlp-proto-http'
+        ]
     },
     license='Apache-2.0',
     zip_safe=False,
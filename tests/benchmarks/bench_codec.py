@@ -0,0 +1,131 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Micro-benchmarks for the codec with cache and archive payloads.
+
+Compares the previous standard library encoding with the codec in
+stdlib and orjson mode. Run with:
+
+    python tests/benchmarks/bench_codec.py
+"""
+
+import base64
+import json
+import timeit
+
+from csp_billing_adapter_k8s import codec
+from csp_billing_adapter_k8s.archive_index import serialize_archive
+
+RECORD = {
+    'managed_node_count': 10,
+    'reporting_time': '2024-02-09T18:11:59.527064+00:00',
+    'base_product': 'cpe:/o:suse:product:v1.2.3'
+}
+
+
+def make_cache(records: int) -> dict:
+    return {
+        'adapter_start_time': '2024-02-09T18:11:59.527064+00:00',
+        'next_bill_time': '2024-03-09T18:11:59.527064+00:00',
+        'next_reporting_time': '2024-02-09T19:11:59.527064+00:00',
+        'usage_records': [dict(RECORD) for _ in range(records)],
+        'last_bill': {}
+    }
+
+
+def make_archive(bills: int) -> list:
+    return [
+        {
+            'billing_time': f'2024-02-09T18:11:{i:08d}+00:00',
+            'billing_status': {
+                'tier_1': {'record_id': str(i), 'status': 'succeeded'}
+            },
+            'billed_usage': {'tier_1': 10},
+            'usage_records': [dict(RECORD) for _ in range(24)]
+        }
+        for i in range(bills)
+    ]
+
+
+def legacy_cache_encode(cache):
+    return base64.b64encode(json.dumps(cache).encode()).decode()
+
+
+def legacy_cache_decode(data):
+    return json.loads(base64.b64decode(data).decode())
+
+
+def codec_cache_encode(cache):
+    return base64.b64encode(codec.dumps(cache)).decode()
+
+
+def codec_cache_decode(data):
+    return codec.loads(base64.b64decode(data))
+
+
+def bench(name, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f'  {name:<32} {seconds * 1000:8.3f} ms')
+
+
+def run(mode):
+    print(f'codec mode: {mode}')
+    cache = make_cache(10000)
+    archive = make_archive(500)
+    encoded_cache = legacy_cache_encode(cache)
+    serialized_archive = json.dumps(archive)
+
+    bench('cache encode (legacy)', lambda: legacy_cache_encode(cache), 5)
+    bench('cache encode (codec)', lambda: codec_cache_encode(cache), 5)
+    bench(
+        'cache decode (legacy)',
+        lambda: legacy_cache_decode(encoded_cache),
+        5
+    )
+    bench(
+        'cache decode (codec)',
+        lambda: codec_cache_decode(encoded_cache),
+        5
+    )
+    bench('archive encode (legacy)', lambda: json.dumps(archive), 5)
+    bench('archive encode (codec)', lambda: serialize_archive(archive), 5)
+    bench(
+        'archive decode (legacy)',
+        lambda: json.loads(serialized_archive),
+        5
+    )
+    bench(
+        'archive decode (codec)',
+        lambda: codec.loads(serialized_archive),
+        5
+    )
+
+
+def main():
+    if codec.orjson is not None:
+        run('orjson')
+
+    fast = codec.orjson
+    codec.orjson = None
+    try:
+        run('stdlib')
+    finally:
+        codec.orjson = fast
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import pytest
+
+from datetime import datetime
+
+from csp_billing_adapter_k8s import codec
+from csp_billing_adapter.config import Config
+
+payloads = [
+    {
+        'adapter_start_time': '2024-02-09T18:11:59.527064+00:00',
+        'usage_records': [
+            {
+                'managed_node_count': 10,
+                'reporting_time': '2024-02-09T18:11:59.527064+00:00',
+                'base_product': 'cpe:/o:suse:product:v1.2.3'
+            }
+        ] * 3,
+        'last_bill': {},
+        'trial_remaining': None,
+        'billing_api_access_ok': True
+    },
+    [
+        {
+            'billing_time': '2024-02-09T18:11:59.527064+00:00',
+            'billing_status': {'tier_1': {'status': 'succeeded'}},
+            'billed_usage': {'tier_1': 10.5}
+        }
+    ],
+    {'unicode': 'café     "quoted" \\ \n \x7f'},
+    {'big': 2 ** 70, 'negative': -2 ** 63, 'float': 0.1},
+    {1: 'non-string key', None: 'null key'},
+    Config({'nested': {'value': 1}}),
+    {'small': 1.5212603486793025e-05, 'tiny': 5e-324, 'zero': 0.0001},
+    [1e16, -1.2345678901234568e+17, 1e15, 1.7976931348623157e+308],
+    1e-05,
+    {'values': [float('nan'), float('inf'), -float('inf')], 'none': None},
+    {'none': None, 'strings': ['0.00001', 'e5', ':1e5', '[0.0000']},
+]
+
+
+@pytest.fixture
+def stdlib_codec(monkeypatch):
+    monkeypatch.setattr(codec, 'orjson', None)
+
+
+@pytest.mark.parametrize('payload', payloads)
+def test_byte_identical(payload, monkeypatch):
+    fast = codec.dumps(payload)
+    fast_str = codec.dumps_str(payload)
+
+    monkeypatch.setattr(codec, 'orjson', None)
+    assert codec.dumps(payload) == fast
+    assert codec.dumps_str(payload) == fast_str
+    assert fast == json.dumps(
+        payload,
+        separators=(',', ':'),
+        ensure_ascii=False
+    ).encode()
+
+
+@pytest.mark.parametrize('payload', payloads[:4])
+@pytest.mark.parametrize('mode', ['fast', 'stdlib'])
+def test_round_trip(payload, mode, monkeypatch):
+    if mode == 'stdlib':
+        monkeypatch.setattr(codec, 'orjson', None)
+
+    assert codec.loads(codec.dumps(payload)) == payload
+    assert codec.loads(codec.dumps_str(payload)) == payload
+
+
+def test_loads_legacy_format():
+    data = json.dumps({'value': float('nan'), 'other': [1, 2]})
+    result = codec.loads(data)
+    assert result['other'] == [1, 2]
+
+
+def test_loads_invalid():
+    with pytest.raises(ValueError):
+        codec.loads(b'{"truncated": ')
+
+
+def test_dumps_unsupported_type(stdlib_codec):
+    with pytest.raises(TypeError):
+        codec.dumps({'time': datetime.now()})
+
+
+def test_dumps_unsupported_type_fast():
+    with pytest.raises(TypeError):
+        codec.dumps({'time': datetime.now()})
+
+
+@pytest.mark.parametrize('payload,expected', [
+    (payloads[0], True),
+    ({'float': 0.1, 'none': None}, True),
+    ({'float': 1e-05}, False),
+    ([1e16], False),
+    ({'nan': float('nan')}, False),
+    ({'nested': [{'inf': float('inf')}]}, False),
+])
+def test_matches_stdlib(payload, expected):
+    pytest.importorskip('orjson')
+    data = codec.orjson.dumps(payload)
+    assert codec._matches_stdlib(payload, data) is expected
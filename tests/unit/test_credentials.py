@@ -0,0 +1,124 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import pytest
+
+from unittest.mock import patch
+
+from kubernetes import client
+from kubernetes.config import ConfigException
+
+from csp_billing_adapter_k8s.credentials import CredentialManager
+
+
+def load_incluster_config(client_configuration, try_refresh_token):
+    assert try_refresh_token is False
+    client_configuration.host = 'https://cluster'
+    client_configuration.api_key['BearerToken'] = 'bearer token-1'
+
+
+def auth_header(configuration):
+    return configuration.auth_settings()['BearerToken']['value']
+
+
+@pytest.fixture
+def token_file(tmp_path):
+    token_file = tmp_path / 'token'
+    token_file.write_text('token-1')
+    return token_file
+
+
+@patch(
+    'csp_billing_adapter_k8s.credentials.load_incluster_config',
+    side_effect=load_incluster_config
+)
+def test_load_in_cluster_cached(mock_load_incluster_config, token_file):
+    manager = CredentialManager(token_path=str(token_file))
+    configuration = manager.load()
+
+    assert manager.in_cluster
+    assert configuration.host == 'https://cluster'
+    assert manager.token_mtime == os.stat(token_file).st_mtime_ns
+    assert manager.load() is configuration
+    mock_load_incluster_config.assert_called_once()
+
+
+@patch('csp_billing_adapter_k8s.credentials.load_kube_config')
+@patch('csp_billing_adapter_k8s.credentials.load_incluster_config')
+def test_load_kube_config(mock_load_incluster_config, mock_load_kube_config):
+    mock_load_incluster_config.side_effect = ConfigException
+    manager = CredentialManager()
+    configuration = manager.load()
+
+    assert not manager.in_cluster
+    assert not manager.refresh_if_rotated()
+    mock_load_kube_config.assert_called_once_with(
+        client_configuration=configuration
+    )
+
+    # Kube config is reloaded into the cached configuration
+    assert manager.refresh()
+    assert mock_load_kube_config.call_count == 2
+    assert manager.configuration is configuration
+
+
+@patch(
+    'csp_billing_adapter_k8s.credentials.load_incluster_config',
+    side_effect=load_incluster_config
+)
+def test_token_rotation(mock_load_incluster_config, token_file):
+    manager = CredentialManager(token_path=str(token_file))
+    configuration = manager.load()
+    api_client = client.ApiClient(configuration)
+
+    # Unchanged token file is not read
+    with patch('builtins.open') as mock_open:
+        assert not manager.refresh_if_rotated()
+        mock_open.assert_not_called()
+
+    token_file.write_text('token-2')
+    mtime = manager.token_mtime + 1
+    os.utime(token_file, ns=(mtime, mtime))
+
+    assert manager.refresh_if_rotated()
+    assert manager.token_mtime == mtime
+    assert not manager.refresh_if_rotated()
+
+    # The shared client uses the refreshed token without being rebuilt
+    assert auth_header(api_client.configuration) == 'bearer token-2'
+
+
+@patch(
+    'csp_billing_adapter_k8s.credentials.load_incluster_config',
+    side_effect=load_incluster_config
+)
+def test_refresh_empty_token(mock_load_incluster_config, token_file):
+    manager = CredentialManager(token_path=str(token_file))
+    manager.load()
+    token_file.write_text('')
+
+    with pytest.raises(ConfigException):
+        manager.refresh()
+
+    assert auth_header(manager.configuration) == 'bearer token-1'
+
+
+def test_refresh_not_loaded():
+    manager = CredentialManager()
+
+    assert not manager.refresh()
+    assert not manager.refresh_if_rotated()
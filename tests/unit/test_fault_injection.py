@@ -0,0 +1,186 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import pytest
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from urllib3.exceptions import ProtocolError
+
+from csp_billing_adapter_k8s import fault_injection, plugin
+from csp_billing_adapter_k8s.fault_injection import (
+    FakeApiServer,
+    FaultInjectingTransport,
+    FaultProfile,
+    SimulatedClock,
+    create_api_client,
+    run_scenario
+)
+
+SECRETS = '/api/v1/namespaces/ns/secrets'
+
+
+def test_fake_api_server():
+    server = FakeApiServer()
+    body = json.dumps({'metadata': {'name': 'cache'}, 'data': {'a': '1'}})
+
+    assert server.handle('GET', f'{SECRETS}/cache', None)[0] == 404
+    assert server.handle('POST', SECRETS, body)[0] == 201
+    assert server.handle('POST', SECRETS, body)[0] == 409
+
+    status, obj = server.handle(
+        'PATCH',
+        f'{SECRETS}/cache',
+        json.dumps({'data': {'b': '2'}})
+    )
+    assert status == 200
+    assert obj['data'] == {'a': '1', 'b': '2'}
+    assert obj['metadata']['resourceVersion'] == '2'
+    assert server.handle('DELETE', f'{SECRETS}/cache', None)[0] == 405
+
+
+def test_fake_api_server_discovery():
+    server = FakeApiServer()
+    server.add_api_resource('product.com', 'v1', 'records', preferred=False)
+    server.add_api_resource('product.com', 'v2', 'records', namespaced=True)
+    api_client = create_api_client(
+        FaultInjectingTransport(server, FaultProfile())
+    )
+
+    groups = client.ApisApi(api_client).get_api_versions().groups
+    assert len(groups) == 1
+    assert groups[0].preferred_version.version == 'v2'
+    assert [gv.version for gv in groups[0].versions] == ['v1', 'v2']
+
+    resources = client.CustomObjectsApi(api_client).get_api_resources(
+        'product.com',
+        'v2'
+    )
+    assert resources.resources[0].name == 'records'
+    assert resources.resources[0].namespaced
+
+
+def test_transport_serves_backend():
+    server = FakeApiServer()
+    server.add_object(f'{SECRETS}/cache', {'data': {'data': 'e30='}})
+    api = client.CoreV1Api(
+        create_api_client(FaultInjectingTransport(server, FaultProfile()))
+    )
+
+    assert api.read_namespaced_secret('cache', 'ns').data == {'data': 'e30='}
+
+
+@pytest.mark.parametrize('status', [409, 410, 429, 500])
+def test_transport_error_status(status):
+    transport = FaultInjectingTransport(
+        FakeApiServer(),
+        FaultProfile(error_rates={status: 1.0})
+    )
+    api = client.CoreV1Api(create_api_client(transport))
+
+    with pytest.raises(ApiException) as error:
+        api.read_namespaced_secret('cache', 'ns')
+
+    assert error.value.status == status
+    assert transport.faults == {status: 1}
+
+
+def test_transport_reset_and_truncate():
+    server = FakeApiServer()
+    server.add_object(f'{SECRETS}/cache', {'data': {'data': 'e30='}})
+
+    transport = FaultInjectingTransport(server, FaultProfile(reset_rate=1.0))
+    api = client.CoreV1Api(create_api_client(transport))
+    with pytest.raises(ProtocolError):
+        api.read_namespaced_secret('cache', 'ns')
+
+    transport = FaultInjectingTransport(
+        server,
+        FaultProfile(truncate_rate=1.0)
+    )
+    api = client.CoreV1Api(create_api_client(transport))
+    with pytest.raises(ValueError):
+        api.read_namespaced_secret('cache', 'ns')
+
+
+@pytest.mark.parametrize('latency', [
+    ('constant', 0.5),
+    ('uniform', 0.1, 0.2),
+    ('exponential', 0.1),
+    ('lognormal', -2, 0.5)
+])
+def test_transport_latency(latency):
+    clock = SimulatedClock()
+    transport = FaultInjectingTransport(
+        FakeApiServer(),
+        FaultProfile(latency=latency),
+        sleep=clock.sleep
+    )
+    transport.request('GET', 'http://fake/api/v1/missing')
+
+    assert clock.now > 0
+    if latency[0] == 'uniform':
+        assert 0.1 <= clock.now <= 0.2
+
+
+def test_run_scenario_healthy():
+    report = run_scenario(FaultProfile(), iterations=5)
+
+    for name, stats in report.items():
+        if name in ('faults', 'requests'):
+            continue
+
+        assert stats['calls'] == 5
+        assert stats['failures'] == 0
+        assert stats['retries'] == 0
+        assert stats['incorrect'] == 0
+
+    assert report['faults'] == {}
+    assert plugin.api_client is None
+
+
+def test_run_scenario_deterministic():
+    profile = fault_injection.PROFILES['flapping']
+
+    first = run_scenario(profile, iterations=10)
+    second = run_scenario(profile, iterations=10)
+
+    assert first['faults'] == second['faults']
+    assert first['requests'] == second['requests']
+    assert first['faults']
+    assert sum(
+        stats['retries'] for name, stats in first.items()
+        if name not in ('faults', 'requests')
+    )
+
+
+def test_main(capsys, monkeypatch):
+    monkeypatch.setattr(
+        fault_injection,
+        'PROFILES',
+        {'healthy': FaultProfile()}
+    )
+    monkeypatch.setattr(
+        fault_injection,
+        'run_scenario',
+        lambda profile: {'requests': 1}
+    )
+    fault_injection.main()
+
+    assert json.loads(capsys.readouterr().out) == {
+        'healthy': {'requests': 1}
+    }
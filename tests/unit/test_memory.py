@@ -0,0 +1,182 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Memory regression tests for large caches and archives.
+
+Each hook is run against an in-memory API server and the peak traced
+allocation is compared to the budget in tests/data/memory_budgets.yaml.
+"""
+
+import tracemalloc
+import pytest
+import yaml
+
+from unittest.mock import patch
+
+from csp_billing_adapter_k8s import codec, plugin
+from csp_billing_adapter_k8s.fault_injection import (
+    FakeApiServer,
+    FaultInjectingTransport,
+    FaultProfile,
+    create_api_client
+)
+from csp_billing_adapter_k8s.payload_budget import PayloadBudget
+from csp_billing_adapter.config import Config
+
+with open('tests/data/memory_budgets.yaml') as budget_file:
+    memory_budgets = yaml.safe_load(budget_file)
+
+config = Config({})
+record = {
+    'managed_node_count': 10,
+    'reporting_time': '2024-02-09T18:11:59.527064+00:00',
+    'base_product': 'cpe:/o:suse:product:v1.2.3'
+}
+
+
+def make_cache(records: int) -> dict:
+    return {
+        'adapter_start_time': '2024-02-09T18:11:59.527064+00:00',
+        'next_bill_time': '2024-03-09T18:11:59.527064+00:00',
+        'next_reporting_time': '2024-02-09T19:11:59.527064+00:00',
+        'usage_records': [
+            {**record, 'managed_node_count': i} for i in range(records)
+        ],
+        'last_bill': {}
+    }
+
+
+def make_archive(bills: int) -> list:
+    return [
+        {
+            'billing_time': f'2024-02-09T18:11:{i:08d}+00:00',
+            'billing_status': {
+                'tier_1': {'record_id': str(i), 'status': 'succeeded'}
+            },
+            'billed_usage': {'tier_1': 10},
+            'usage_records': [dict(record) for _ in range(4)]
+        }
+        for i in range(bills)
+    ]
+
+
+def peak_memory(func) -> int:
+    """Return the peak traced allocation in bytes while running func."""
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    del result
+    return peak
+
+
+def check_budget(name: str, func, payload_size: int):
+    peak = peak_memory(func)
+    budget = memory_budgets['budgets'][name]
+
+    assert peak <= budget * payload_size, (
+        f'{name} peak memory {peak} bytes is {peak / payload_size:.1f} '
+        f'times the {payload_size} bytes payload, budget is {budget}'
+    )
+
+
+@pytest.fixture
+def api_server():
+    server = FakeApiServer()
+    transport = FaultInjectingTransport(
+        server,
+        FaultProfile(),
+        sleep=lambda seconds: None
+    )
+
+    with patch.object(plugin, 'api_client', create_api_client(transport)), \
+            patch.object(plugin, 'payload_budget', PayloadBudget(10 ** 9)):
+        # Warm up to exclude one time import and setup allocations
+        plugin.get_cache(config)
+        plugin.save_csp_config(config, {})
+        plugin.get_csp_config(config)
+        server.objects.clear()
+        yield server
+
+
+@pytest.mark.parametrize('records', memory_budgets['cache_sizes'])
+def test_cache_memory(api_server, records):
+    cache = make_cache(records)
+    size = len(codec.dumps(cache))
+
+    check_budget('save_cache', lambda: plugin.save_cache(config, cache), size)
+    check_budget('get_cache', lambda: plugin.get_cache(config), size)
+    check_budget(
+        'update_cache',
+        lambda: plugin.update_cache(config, {'other': 'info'}, False),
+        size
+    )
+
+
+@pytest.mark.parametrize('records', memory_budgets['cache_sizes'])
+def test_csp_config_memory(api_server, records):
+    # csp-config is small in practice, use a large errors list
+    csp_config = {'errors': [record] * records}
+    size = len(codec.dumps(csp_config))
+
+    check_budget(
+        'save_csp_config',
+        lambda: plugin.save_csp_config(config, csp_config),
+        size
+    )
+    check_budget('get_csp_config', lambda: plugin.get_csp_config(config), size)
+    check_budget(
+        'update_csp_config',
+        lambda: plugin.update_csp_config(config, {'other': 'info'}, False),
+        size
+    )
+
+
+@pytest.mark.parametrize('bills', memory_budgets['archive_sizes'])
+def test_archive_memory(api_server, bills):
+    archive = make_archive(bills)
+    size = len(codec.dumps(archive))
+    billing_time = archive[bills // 2]['billing_time']
+
+    check_budget(
+        'save_metering_archive',
+        lambda: plugin.save_metering_archive(config, archive),
+        size
+    )
+    check_budget(
+        'update_metering_archive',
+        lambda: plugin.save_metering_archive(config, archive),
+        size
+    )
+    check_budget(
+        'get_metering_archive',
+        lambda: plugin.get_metering_archive(config),
+        size
+    )
+    check_budget(
+        'get_archive_entry',
+        lambda: plugin.get_archive_entry(config, billing_time),
+        size
+    )
+    check_budget(
+        'get_archive_status',
+        lambda: plugin.get_archive_status(config),
+        size
+    )
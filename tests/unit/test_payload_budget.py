@@ -0,0 +1,77 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import base64
+
+from csp_billing_adapter_k8s.payload_budget import (
+    PayloadBudget,
+    base64_size,
+    utf8_size
+)
+
+
+def test_base64_size():
+    for size in range(10):
+        assert base64_size(size) == len(base64.b64encode(b'x' * size))
+
+
+def test_budget_report():
+    budget = PayloadBudget(limit=1000, warn_ratio=0.5, compact_ratio=0.9)
+    assert budget.compact_size == 900
+    assert not budget.should_compact(899)
+    assert budget.should_compact(900)
+
+    budget.record('cache', 100)
+    assert budget.growth_per_write('cache') == 0
+    assert budget.writes_until_limit('cache') is None
+
+    budget.record('cache', 300)
+    budget.record('cache', 500)
+
+    report = budget.report()['cache']
+    assert report['size'] == 500
+    assert report['ratio'] == 0.5
+    assert report['growth_per_write'] == 200
+    assert report['writes_until_limit'] == 2
+
+
+def test_budget_warnings(caplog):
+    budget = PayloadBudget(limit=1000, warn_ratio=0.5)
+
+    budget.record('cache', 400)
+    assert not caplog.records
+
+    budget.record('cache', 600)
+    assert 'cache is 600 bytes, 60% of the 1000 bytes limit' in caplog.text
+    assert 'Projected writes until limit: 2' in caplog.text
+
+    budget.record('cache', 1200)
+    assert 'exceeds the 1000 bytes limit' in caplog.text
+
+
+def test_budget_history_bounded():
+    budget = PayloadBudget(history=3)
+
+    for size in range(10):
+        budget.record('cache', size)
+
+    assert list(budget.sizes['cache']) == [7, 8, 9]
+
+
+def test_utf8_size():
+    assert utf8_size('abc') == 3
+    assert utf8_size('caf\u00e9') == 5
+    assert utf8_size('\u20ac' * 4) == 12
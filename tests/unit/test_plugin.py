@@ -23,9 +23,21 @@ from datetime import datetime
 from unittest.mock import Mock, patch
 
 from kubernetes.config import ConfigException
+from kubernetes.client import (
+    V1APIGroup,
+    V1APIGroupList,
+    V1APIResource,
+    V1APIResourceList,
+    V1GroupVersionForDiscovery
+)
 from kubernetes.client.rest import ApiException
 
-from csp_billing_adapter_k8s import plugin
+from csp_billing_adapter_k8s import codec, plugin
+from csp_billing_adapter_k8s.archive_index import get_indexed_entry
+from csp_billing_adapter_k8s.credentials import CredentialManager
+from csp_billing_adapter_k8s.payload_budget import PayloadBudget
+from csp_billing_adapter_k8s.usage_buffer import UsageAggregator
+from csp_billing_adapter_k8s.usage_discovery import DiscoveryCache
 from csp_billing_adapter.config import Config
 from csp_billing_adapter.adapter import get_plugin_manager
 from csp_billing_adapter.exceptions import CSPBillingAdapterException
@@ -72,6 +84,49 @@ metering_archive = [
 ]
 
 
+@pytest.fixture(autouse=True)
+def usage_discovery():
+    with patch.object(plugin, 'usage_discovery', DiscoveryCache(3600)):
+        yield plugin.usage_discovery
+
+
+def mock_discovery(
+    mock_client,
+    api,
+    versions=('v1',),
+    preferred='v1',
+    namespaced=False
+):
+    group_versions = [
+        V1GroupVersionForDiscovery(
+            group_version=f'product.com/{version}',
+            version=version
+        )
+        for version in versions
+    ]
+    mock_client.ApisApi.return_value.get_api_versions.return_value = (
+        V1APIGroupList(groups=[
+            V1APIGroup(
+                name='product.com',
+                versions=group_versions,
+                preferred_version=group_versions[versions.index(preferred)]
+            )
+        ])
+    )
+    api.get_api_resources.return_value = V1APIResourceList(
+        group_version=f'product.com/{preferred}',
+        resources=[
+            V1APIResource(
+                name='productusagerecords',
+                kind='ProductUsageRecord',
+                namespaced=namespaced,
+                singular_name='',
+                verbs=['get', 'list', 'watch']
+            )
+        ]
+    )
+
+
 def create_exception(status: int):
     response = Mock()
     response.status = status
@@ -81,13 +136,65 @@ def create_exception(status: int):
     return ApiException(http_resp=response)
 
 
-@patch('csp_billing_adapter_k8s.plugin.load_kube_config')
-@patch('csp_billing_adapter_k8s.plugin.load_incluster_config')
+@patch.object(plugin, 'api_client', None)
+@patch.object(plugin, 'credential_manager', CredentialManager())
+@patch('csp_billing_adapter_k8s.credentials.load_kube_config')
+@patch('csp_billing_adapter_k8s.credentials.load_incluster_config')
 def test_setup(mock_load_incluster_cfg, mock_load_kube_cfg):
     # Test fallback
     mock_load_incluster_cfg.side_effect = ConfigException
     plugin.setup_adapter(config)
 
+    configuration = plugin.credential_manager.configuration
+    mock_load_kube_cfg.assert_called_once_with(
+        client_configuration=configuration
+    )
+    assert plugin.api_client.configuration is configuration
+
+    # Configuration and client are cached
+    api_client = plugin.api_client
+    plugin.setup_adapter(config)
+    mock_load_kube_cfg.assert_called_once()
+    assert plugin.api_client is api_client
+
+
+@patch.object(plugin, 'credential_manager')
+def test_call_api_unauthorized_retry(mock_credential_manager):
+    api = Mock()
+    api.read_namespaced_secret.side_effect = [
+        create_exception(status=401),
+        Mock(data={'data': 'e30='})
+    ]
+    mock_credential_manager.refresh.return_value = True
+
+    result = plugin._call_api(
+        api,
+        'read_namespaced_secret',
+        'csp-adapter-cache',
+        'ns'
+    )
+
+    assert result.data == {'data': 'e30='}
+    mock_credential_manager.refresh_if_rotated.assert_called_once_with()
+    mock_credential_manager.refresh.assert_called_once_with()
+    assert api.read_namespaced_secret.call_count == 2
+
+    # Only one retry after refresh
+    api.read_namespaced_secret.side_effect = create_exception(status=401)
+
+    with pytest.raises(ApiException):
+        plugin._call_api(api, 'read_namespaced_secret', 'name', 'ns')
+
+    assert api.read_namespaced_secret.call_count == 4
+
+    # No retry if credentials could not be refreshed
+    mock_credential_manager.refresh.return_value = False
+
+    with pytest.raises(ApiException):
+        plugin._call_api(api, 'read_namespaced_secret', 'name', 'ns')
+
+    assert api.read_namespaced_secret.call_count == 5
+
 
 @patch('csp_billing_adapter_k8s.plugin.client')
 def test_save_cache_exists(mock_client):
@@ -237,6 +344,34 @@ def test_update_csp_config(mock_client, mock_get_csp_config):
     plugin.update_csp_config(config, data, replace=False)
 
 
+@patch.object(plugin, 'payload_budget', PayloadBudget(limit=4096))
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_csp_config_payload_budget(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+
+    plugin.update_cache(config, cache, replace=True)
+    plugin.update_csp_config(config, csp_config, replace=True)
+    plugin.update_csp_config(config, csp_config, replace=True)
+
+    # The report is published with the csp-config
+    name, _, body = api.patch_namespaced_config_map.call_args.args
+    assert name == 'csp-config'
+    assert json.loads(body['data']['data']) == csp_config
+    report = json.loads(body['data']['payload_budget'])
+    assert set(report) == {'csp-adapter-cache', 'csp-config'}
+    size = len(body['data']['data']) + len(body['data']['payload_budget'])
+    assert abs(report['csp-config']['size'] - size) < 10
+    assert report['csp-config']['limit'] == 4096
+    assert api.patch_namespaced_config_map.call_args.kwargs == {}
+
+    # Only the csp config is read back
+    response = Mock()
+    response.data = body['data']
+    api.read_namespaced_config_map.return_value = response
+    assert plugin.get_csp_config(config) == csp_config
+
+
 @patch('csp_billing_adapter_k8s.plugin.client')
 def test_get_usage(mock_client):
     resource = {
@@ -246,6 +381,7 @@ def test_get_usage(mock_client):
     api = Mock()
     api.get_cluster_custom_object.return_value = resource
     mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api)
 
     response = plugin.get_usage_data(config)
     assert response['timestamp'] == now
@@ -256,6 +392,7 @@ def test_get_usage_not_exists(mock_client):
     api = Mock()
     api.get_cluster_custom_object.side_effect = create_exception(status=404)
     mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api)
 
     with pytest.raises(Exception):
         plugin.get_usage_data(config)
@@ -266,6 +403,7 @@ def test_get_usage_error(mock_client):
     api = Mock()
     api.get_cluster_custom_object.side_effect = create_exception(status=400)
     mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api)
 
     with pytest.raises(CSPBillingAdapterException):
         plugin.get_usage_data(config)
@@ -276,11 +414,227 @@ def test_get_usage_error_unexpected_format(mock_client):
     api = Mock()
     api.get_cluster_custom_object.side_effect = ApiException(status=400)
     mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api)
 
     with pytest.raises(CSPBillingAdapterException):
         plugin.get_usage_data(config)
 
 
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_usage_namespaced(mock_client):
+    api = Mock()
+    api.get_namespaced_custom_object.return_value = {'count': 1}
+    mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api, versions=('v1', 'v2'), namespaced=True)
+
+    assert plugin.get_usage_data(config) == {'count': 1}
+    api.get_api_resources.assert_called_once_with('product.com', 'v1')
+    api.get_namespaced_custom_object.assert_called_once_with(
+        name='product-usage',
+        group='product.com',
+        version='v1',
+        plural='productusagerecords',
+        namespace='product-billing-adapter'
+    )
+    api.get_cluster_custom_object.assert_not_called()
+
+
+@patch.object(plugin, 'usage_api_version', None)
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_usage_preferred_version(mock_client):
+    api = Mock()
+    api.get_cluster_custom_object.return_value = {'count': 1}
+    mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api, versions=('v1', 'v2'), preferred='v2')
+
+    plugin.get_usage_data(config)
+    plugin.get_usage_data(config)
+
+    # Discovery is cached
+    mock_client.ApisApi.return_value.get_api_versions.assert_called_once()
+    assert api.get_cluster_custom_object.call_args.kwargs['version'] == 'v2'
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_usage_rediscover(mock_client, usage_discovery):
+    api = Mock()
+    api.get_cluster_custom_object.return_value = {'count': 1}
+    mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api)
+    plugin.get_usage_data(config)
+
+    # The product upgrade removed v1
+    mock_discovery(mock_client, api, versions=('v2',), preferred='v2')
+    api.get_cluster_custom_object.side_effect = [
+        create_exception(status=404),
+        {'count': 2}
+    ]
+
+    assert plugin.get_usage_data(config) == {'count': 2}
+    get_api_versions = mock_client.ApisApi.return_value.get_api_versions
+    assert get_api_versions.call_count == 2
+    assert api.get_cluster_custom_object.call_args.kwargs['version'] == 'v2'
+    assert usage_discovery.resource.version == 'v2'
+
+    # Rediscovery happens once per call
+    api.get_cluster_custom_object.side_effect = create_exception(status=404)
+
+    with pytest.raises(Exception, match='Usage resource not found'):
+        plugin.get_usage_data(config)
+
+    assert get_api_versions.call_count == 3
+    assert api.get_cluster_custom_object.call_count == 5
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_usage_not_served(mock_client, usage_discovery):
+    api = Mock()
+    mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api)
+    api.get_api_resources.return_value = V1APIResourceList(
+        group_version='product.com/v1',
+        resources=[]
+    )
+
+    with pytest.raises(Exception, match='Usage resource not found'):
+        plugin.get_usage_data(config)
+
+    # The missing resource is cached
+    api.get_api_resources.assert_called_once()
+    api.get_cluster_custom_object.assert_not_called()
+    assert usage_discovery.fresh()
+    assert usage_discovery.resource is None
+
+    # A cached missing resource is discovered again once
+    with pytest.raises(Exception, match='Usage resource not found'):
+        plugin.get_usage_data(config)
+
+    assert api.get_api_resources.call_count == 2
+    api.get_api_resources.reset_mock()
+
+    # Missing API group
+    usage_discovery.invalidate()
+    mock_client.ApisApi.return_value.get_api_versions.return_value = (
+        V1APIGroupList(groups=[])
+    )
+
+    with pytest.raises(Exception, match='Usage resource not found'):
+        plugin.get_usage_data(config)
+
+    api.get_api_resources.assert_not_called()
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_usage_served_after_upgrade(mock_client, usage_discovery):
+    api = Mock()
+    api.get_cluster_custom_object.return_value = {'count': 1}
+    mock_client.CustomObjectsApi.return_value = api
+
+    # The CRD is briefly not served during the upgrade
+    mock_client.ApisApi.return_value.get_api_versions.return_value = (
+        V1APIGroupList(groups=[])
+    )
+
+    with pytest.raises(Exception, match='Usage resource not found'):
+        plugin.get_usage_data(config)
+
+    assert usage_discovery.fresh()
+    assert usage_discovery.resource is None
+
+    # The new version is served while the missing CRD is still cached
+    mock_discovery(mock_client, api, versions=('v2',), preferred='v2')
+
+    assert plugin.get_usage_data(config) == {'count': 1}
+    assert api.get_cluster_custom_object.call_args.kwargs['version'] == 'v2'
+    assert usage_discovery.resource.version == 'v2'
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_usage_discovery_error(mock_client):
+    api = Mock()
+    api.get_cluster_custom_object.return_value = {'count': 1}
+    mock_client.CustomObjectsApi.return_value = api
+    get_api_versions = mock_client.ApisApi.return_value.get_api_versions
+    get_api_versions.side_effect = create_exception(status=403)
+
+    # The pinned version is used without discovery
+    assert plugin.get_usage_data(config) == {'count': 1}
+    api.get_cluster_custom_object.assert_called_once_with(
+        name='product-usage',
+        group='product.com',
+        version='v1',
+        plural='productusagerecords'
+    )
+
+    plugin.usage_discovery.invalidate()
+
+    with patch.object(plugin, 'usage_api_version', None):
+        with pytest.raises(CSPBillingAdapterException) as error:
+            plugin.get_usage_data(config)
+
+    assert 'Failed to resolve usage resource.' in str(error.value)
+
+
+@patch.object(plugin, 'usage_buffer', UsageAggregator())
+@patch('csp_billing_adapter_k8s.plugin.watch')
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_watch_usage_rediscover(mock_client, mock_watch, usage_discovery):
+    api = mock_client.CustomObjectsApi.return_value
+    mock_discovery(mock_client, api, namespaced=True)
+
+    def stop_events(*args, **kwargs):
+        plugin.usage_watch_stop.set()
+        yield {'type': 'ADDED', 'object': {'managed_node_count': 10}}
+
+    mock_watch.Watch.return_value.stream.side_effect = [
+        create_exception(status=404),
+        stop_events()
+    ]
+
+    with patch.object(plugin.usage_watch_stop, 'wait'):
+        plugin._watch_usage()
+
+    plugin.usage_watch_stop.clear()
+    stream = mock_watch.Watch.return_value.stream
+    assert stream.call_args.args == (api.list_namespaced_custom_object,)
+    assert stream.call_args.kwargs['namespace'] == 'product-billing-adapter'
+    get_api_versions = mock_client.ApisApi.return_value.get_api_versions
+    assert get_api_versions.call_count == 2
+    assert plugin.usage_buffer.latest == {'managed_node_count': 10}
+
+
+@patch.object(plugin, 'usage_buffer', UsageAggregator())
+@patch('csp_billing_adapter_k8s.plugin.watch')
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_watch_usage_served_after_upgrade(mock_client, mock_watch):
+    api = mock_client.CustomObjectsApi.return_value
+    mock_client.ApisApi.return_value.get_api_versions.return_value = (
+        V1APIGroupList(groups=[])
+    )
+    now = [0.0]
+    cache = DiscoveryCache(3600, negative_ttl=30, clock=lambda: now[0])
+
+    def wait(timeout):
+        # The new version is served after the first retry
+        now[0] += 31
+        mock_discovery(mock_client, api, versions=('v2',), preferred='v2')
+
+    def stop_events(*args, **kwargs):
+        plugin.usage_watch_stop.set()
+        yield {'type': 'ADDED', 'object': {'managed_node_count': 10}}
+
+    mock_watch.Watch.return_value.stream.side_effect = [stop_events()]
+
+    with patch.object(plugin, 'usage_discovery', cache), \
+            patch.object(plugin.usage_watch_stop, 'wait', side_effect=wait):
+        plugin._watch_usage()
+
+    plugin.usage_watch_stop.clear()
+    stream = mock_watch.Watch.return_value.stream
+    assert stream.call_args.kwargs['version'] == 'v2'
+    assert plugin.usage_buffer.latest == {'managed_node_count': 10}
+
+
 def test_get_version():
     version = plugin.get_version()
     assert version[0] == 'k8s_plugin'
@@ -330,15 +684,32 @@ def test_get_metering_archive_error(mock_client):
 def test_save_metering_archive_error(mock_client):
     api = Mock()
     mock_client.CoreV1Api.return_value = api
+    api.patch_namespaced_config_map.side_effect = create_exception(status=404)
     api.create_namespaced_config_map.side_effect = create_exception(status=400)
 
-    response = Mock()
-    response.data = {}
-    api.read_namespaced_config_map.return_value = response
+    with pytest.raises(CSPBillingAdapterException) as error:
+        plugin.save_metering_archive(config, metering_archive)
 
-    with pytest.raises(CSPBillingAdapterException):
+    assert 'Failed to save metering archive.' in str(error.value)
+
+    api.patch_namespaced_config_map.side_effect = create_exception(status=400)
+
+    with pytest.raises(CSPBillingAdapterException) as error:
         plugin.save_metering_archive(config, metering_archive)
 
+    assert 'Failed to save metering archive.' in str(error.value)
+
+    # The index is named when only its write fails
+    api.patch_namespaced_config_map.side_effect = [
+        None,
+        create_exception(status=400)
+    ]
+
+    with pytest.raises(CSPBillingAdapterException) as error:
+        plugin.save_metering_archive(config, metering_archive)
+
+    assert 'Failed to save metering archive index.' in str(error.value)
+
 
 @patch('csp_billing_adapter_k8s.plugin.client')
 def test_update_metering_archive(mock_client):
@@ -346,23 +717,444 @@ def test_update_metering_archive(mock_client):
     mock_client.CoreV1Api.return_value = api
     api.patch_namespaced_config_map.return_value = None
 
-    response = Mock()
-    response.data = {
-        'archive': json.dumps(metering_archive)
-    }
-    api.read_namespaced_config_map.return_value = response
-
     plugin.save_metering_archive(config, metering_archive)
 
+    # The existing archive is not read
+    api.read_namespaced_config_map.assert_not_called()
+    api.create_namespaced_config_map.assert_not_called()
+    assert [
+        call.args[0] for call in api.patch_namespaced_config_map.call_args_list
+    ] == ['metering-archive', 'metering-archive-index']
+
 
 @patch('csp_billing_adapter_k8s.plugin.client')
 def test_save_metering_archive(mock_client):
     api = Mock()
     mock_client.CoreV1Api.return_value = api
-    api.patch_namespaced_config_map.return_value = None
+    api.patch_namespaced_config_map.side_effect = create_exception(status=404)
+
+    plugin.save_metering_archive(config, metering_archive)
+
+    assert api.create_namespaced_config_map.call_count == 2
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_save_metering_archive_index(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+
+    plugin.save_metering_archive(config, metering_archive)
+
+    archive_call, index_call = api.patch_namespaced_config_map.call_args_list
+    archive = codec.dumps_str(metering_archive)
+    assert archive_call.args[2] == {'data': {'archive': archive}}
+    assert index_call.args[0] == 'metering-archive-index'
+    index_data = index_call.args[2]['data']
+    assert index_data['archive_digest'] == plugin.archive_digest(archive)
+    index = json.loads(index_data['index'])
+    assert index[metering_archive[0]['billing_time']]['billing_status'] == {
+        'tier_1': 'succeeded'
+    }
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_archive_entry(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+
+    second = {**metering_archive[0], 'billing_time': '2024-03-09T18:11:59'}
+    archive, index = plugin.serialize_archive([*metering_archive, second])
+    config_maps = {
+        'metering-archive': Mock(data={'archive': archive}),
+        'metering-archive-index': Mock(data={
+            'index': json.dumps(index),
+            'archive_digest': plugin.archive_digest(archive)
+        })
+    }
+    api.read_namespaced_config_map.side_effect = (
+        lambda name, namespace: config_maps[name]
+    )
+
+    with patch.object(codec, 'loads', wraps=codec.loads) as loads:
+        assert plugin.get_archive_entry(
+            config,
+            second['billing_time']
+        ) == second
+        assert plugin.get_archive_entry(
+            config,
+            metering_archive[0]['billing_time']
+        ) == metering_archive[0]
+        assert plugin.get_archive_entry(config, 'missing') is None
+
+    # Only the index and the indexed entries are parsed
+    assert archive not in [call.args[0] for call in loads.call_args_list]
+    assert api.read_namespaced_config_map.call_count == 6
+
+    # The status only reads the index
+    status = plugin.get_archive_status(config)
+    assert status == {
+        metering_archive[0]['billing_time']: {'tier_1': 'succeeded'},
+        second['billing_time']: {'tier_1': 'succeeded'}
+    }
+    assert api.read_namespaced_config_map.call_args.args[0] == \
+        'metering-archive-index'
+
+    # The archive was saved after the index was read
+    config_maps['metering-archive'] = Mock(
+        data={'archive': json.dumps([second, *metering_archive])}
+    )
+    assert plugin.get_archive_entry(config, second['billing_time']) == second
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_archive_entry_stale_index(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+
+    bills = [
+        {**metering_archive[0], 'billing_time': f'2024-02-0{day}'}
+        for day in range(1, 5)
+    ]
+    # Retention dropped the oldest bill but the index write failed
+    old_archive, old_index = plugin.serialize_archive(bills[:3])
+    archive, _ = plugin.serialize_archive(bills[1:])
+    assert len(archive) == len(old_archive)
+    config_maps = {
+        'metering-archive': Mock(data={'archive': archive}),
+        'metering-archive-index': Mock(data={
+            'index': json.dumps(old_index),
+            'archive_digest': plugin.archive_digest(old_archive)
+        })
+    }
+    api.read_namespaced_config_map.side_effect = (
+        lambda name, namespace: config_maps[name]
+    )
+
+    assert plugin.get_archive_entry(config, '2024-02-02') == bills[1]
+    assert plugin.get_archive_entry(config, '2024-02-04') == bills[3]
+    assert plugin.get_archive_entry(config, '2024-02-01') is None
+
+    # An index without a digest is not trusted
+    del config_maps['metering-archive-index'].data['archive_digest']
+    assert plugin.get_archive_entry(config, '2024-02-02') == bills[1]
+
+
+def test_get_indexed_entry_mismatch():
+    bills = [
+        {**metering_archive[0], 'billing_time': f'2024-02-0{day}'}
+        for day in range(1, 4)
+    ]
+    archive, index = plugin.serialize_archive(bills)
+
+    assert get_indexed_entry(archive, index, '2024-02-02') == bills[1]
+    assert get_indexed_entry(archive, index, 'missing') is None
+
+    # The slice belongs to another bill or does not parse
+    assert get_indexed_entry(archive, {
+        '2024-02-02': index['2024-02-03']
+    }, '2024-02-02') is None
+    assert get_indexed_entry(archive, {
+        '2024-02-02': {**index['2024-02-02'], 'offset': 3}
+    }, '2024-02-02') is None
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_archive_entry_no_index(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+
+    config_maps = {
+        'metering-archive': Mock(
+            data={'archive': json.dumps(metering_archive)}
+        )
+    }
+
+    def read_config_map(name, namespace):
+        if name not in config_maps:
+            raise create_exception(status=404)
+
+        return config_maps[name]
+
+    api.read_namespaced_config_map.side_effect = read_config_map
+
+    billing_time = metering_archive[0]['billing_time']
+    assert plugin.get_archive_entry(config, billing_time) == \
+        metering_archive[0]
+    assert plugin.get_archive_entry(config, 'missing') is None
+    assert plugin.get_archive_status(config) == {
+        billing_time: {'tier_1': 'succeeded'}
+    }
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_archive_entry_not_exists(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+    api.read_namespaced_config_map.side_effect = create_exception(status=404)
+
+    assert plugin.get_archive_entry(config, 'missing') is None
+    assert plugin.get_archive_status(config) == {}
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_archive_entry_error(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+    api.read_namespaced_config_map.side_effect = create_exception(status=400)
+
+    with pytest.raises(CSPBillingAdapterException) as error:
+        plugin.get_archive_entry(config, 'missing')
+
+    assert 'Failed to read metering archive index.' in str(error.value)
+
+
+@patch.object(plugin, 'usage_buffer', UsageAggregator())
+@patch.object(plugin, 'usage_watch', True)
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_usage_watch(mock_client):
+    resource = {
+        'metadata': {'name': 'product-usage'},
+        'reporting_time': now,
+        'managed_node_count': 10
+    }
+    api = Mock()
+    api.get_cluster_custom_object.return_value = resource
+    mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api)
+
+    # Empty buffer falls back to reading the resource
+    response = plugin.get_usage_data(config)
+    assert response == {'reporting_time': now, 'managed_node_count': 10}
+    assert len(plugin.usage_buffer) == 1
+
+    plugin.usage_buffer.record(
+        {'reporting_time': now, 'managed_node_count': 30}
+    )
+    plugin.usage_buffer.touch()
+    response = plugin.get_usage_data(config)
+    assert response['managed_node_count'] > 10
+    api.get_cluster_custom_object.assert_called_once()
+
+
+@patch.object(plugin, 'usage_watch', True)
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_get_usage_watch_stale(mock_client):
+    clock = Mock(return_value=0)
+    api = Mock()
+    api.get_cluster_custom_object.return_value = {
+        'reporting_time': now,
+        'managed_node_count': 10
+    }
+    mock_client.CustomObjectsApi.return_value = api
+    mock_discovery(mock_client, api)
+
+    with patch.object(plugin, 'usage_buffer', UsageAggregator(clock=clock)):
+        plugin.usage_buffer.record({'managed_node_count': 30})
+        plugin.usage_buffer.touch()
+
+        # The watch stopped receiving events
+        clock.return_value = plugin.usage_watch_max_age + 1
+        response = plugin.get_usage_data(config)
+        assert response == {'reporting_time': now, 'managed_node_count': 10}
+        api.get_cluster_custom_object.assert_called_once()
+
+        # The old aggregates are discarded, only the direct read is kept
+        assert plugin.usage_buffer.latest == response
+        assert plugin.usage_buffer.aggregates[
+            'managed_node_count'
+        ].maximum == 10
+
+        # The resource is gone and the watch is broken
+        api.get_cluster_custom_object.side_effect = create_exception(404)
+
+        with pytest.raises(Exception) as error:
+            plugin.get_usage_data(config)
+
+        assert 'Usage resource not found' in str(error.value)
+
+
+@patch.object(plugin, 'usage_buffer', UsageAggregator())
+@patch('csp_billing_adapter_k8s.plugin.watch')
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_watch_usage(mock_client, mock_watch):
+    def events(*args, **kwargs):
+        yield {
+            'type': 'ADDED',
+            'object': {
+                'metadata': {'resourceVersion': '1'},
+                'managed_node_count': 10
+            }
+        }
+        yield {'type': 'ERROR', 'object': {}}
+
+    def deleted_events(*args, **kwargs):
+        yield {
+            'type': 'DELETED',
+            'object': {
+                'metadata': {'resourceVersion': '2'},
+                'managed_node_count': 10
+            }
+        }
+
+    def stop_events(*args, **kwargs):
+        plugin.usage_watch_stop.set()
+        yield {
+            'type': 'MODIFIED',
+            'object': {
+                'metadata': {'resourceVersion': '2'},
+                'managed_node_count': 20
+            }
+        }
+
+    deleted_state = []
+
+    def expired_events(*args, **kwargs):
+        deleted_state.append(
+            (plugin.usage_buffer.latest, plugin.usage_buffer.is_stale(60))
+        )
+        raise create_exception(status=410)
+        yield
+
+    mock_watch.Watch.return_value.stream.side_effect = [
+        events(),
+        deleted_events(),
+        expired_events(),
+        stop_events()
+    ]
+
+    mock_discovery(mock_client, mock_client.CustomObjectsApi.return_value)
+
+    with patch.object(plugin.usage_watch_stop, 'wait'):
+        plugin._watch_usage()
+
+    assert mock_watch.Watch.return_value.stream.call_args.kwargs == {
+        'field_selector': 'metadata.name=product-usage',
+        'resource_version': None,
+        'timeout_seconds': 300,
+        'group': 'product.com',
+        'version': 'v1',
+        'plural': 'productusagerecords'
+    }
+
+    plugin.usage_watch_stop.clear()
+
+    # The deleted resource is not billed and the watch is healthy
+    assert deleted_state == [(None, False)]
+    assert len(plugin.usage_buffer) == 1
+    assert plugin.usage_buffer.latest == {'managed_node_count': 20}
+    assert not plugin.usage_buffer.is_stale(60)
+
+
+@patch.object(plugin, 'api_client', None)
+@patch.object(plugin, 'credential_manager', CredentialManager())
+@patch('csp_billing_adapter_k8s.plugin.threading')
+@patch('csp_billing_adapter_k8s.credentials.load_incluster_config')
+def test_setup_usage_watch(mock_load_incluster_cfg, mock_threading):
+    with patch.object(plugin, 'usage_watch', True):
+        plugin.setup_adapter(config)
+
+    mock_threading.Thread.return_value.start.assert_called_once_with()
+
+    with patch.object(plugin, 'usage_resource', None):
+        plugin._start_usage_watch()
+
+    mock_threading.Thread.assert_called_once()
+
+
+@patch.object(plugin, 'payload_budget', PayloadBudget(limit=4096))
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_cache_compressed_near_limit(mock_client):
+    large_cache = {
+        **cache,
+        'usage_records': [{'managed_node_count': 10}] * 200
+    }
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+
+    plugin.update_cache(config, large_cache, replace=True)
+    data = api.patch_namespaced_secret.call_args[0][2]['data']['data']
+    assert len(data) < 4096
+    assert base64.b64decode(data)[:2] == b'\x1f\x8b'
+
+    report = plugin.get_payload_budget()['csp-adapter-cache']
+    assert report['size'] == len(data)
+
+    response = Mock()
+    response.data = {'data': data}
+    api.read_namespaced_secret.return_value = response
+    assert plugin.get_cache(config) == large_cache
+
+
+@patch.object(plugin, 'payload_budget', PayloadBudget(limit=1024))
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_save_metering_archive_compacted(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+
+    archive = [
+        {**metering_archive[0], 'billing_time': str(i)} for i in range(10)
+    ]
+    plugin.save_metering_archive(config, archive)
+
+    data = api.patch_namespaced_config_map.call_args_list[0].args[2]['data']
+    assert not data['archive'].startswith('[')
+    assert len(data['archive']) < plugin.payload_budget.compact_size
+    assert 'metering-archive' in plugin.get_payload_budget()
+
+    # No entries are dropped
+    index_data = api.patch_namespaced_config_map.call_args_list[1].args[2]
+    assert len(json.loads(index_data['data']['index'])) == 10
 
     response = Mock()
-    response.data = {}
+    response.data = data
     api.read_namespaced_config_map.return_value = response
+    assert plugin.get_metering_archive(config) == archive
+
+
+@patch.object(plugin, 'payload_budget', PayloadBudget(limit=1024))
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_save_metering_archive_compacted_utf8(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+
+    # Fewer characters than the threshold but more UTF-8 bytes
+    archive = [{**metering_archive[0], 'note': '\u20ac' * 300}]
+    serialized = json.dumps(archive, separators=(',', ':'), ensure_ascii=False)
+    assert len(serialized) < plugin.payload_budget.compact_size
+    assert len(serialized.encode()) >= plugin.payload_budget.compact_size
+
+    plugin.save_metering_archive(config, archive)
+
+    archive_data, index_data = [
+        call.args[2]['data']
+        for call in api.patch_namespaced_config_map.call_args_list
+    ]
+    assert not archive_data['archive'].startswith('[')
+
+    index_response = Mock()
+    index_response.data = index_data
+    archive_response = Mock()
+    archive_response.data = archive_data
+    api.read_namespaced_config_map.side_effect = [
+        index_response,
+        archive_response
+    ]
+    entry = plugin.get_archive_entry(config, archive[0]['billing_time'])
+    assert entry == archive[0]
+
+
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_save_metering_archive_created_concurrently(mock_client):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+    api.patch_namespaced_config_map.side_effect = [
+        create_exception(status=404),
+        None,
+        None
+    ]
+    api.create_namespaced_config_map.side_effect = create_exception(status=409)
 
     plugin.save_metering_archive(config, metering_archive)
+
+    api.create_namespaced_config_map.assert_called_once()
+    assert api.patch_namespaced_config_map.call_count == 3
@@ -0,0 +1,388 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import sqlite3
+import pytest
+
+from datetime import datetime
+
+from unittest.mock import Mock, patch
+
+from kubernetes.client.rest import ApiException
+
+from csp_billing_adapter_k8s import plugin, sqlite_storage
+from csp_billing_adapter.config import Config
+from csp_billing_adapter.adapter import get_plugin_manager
+from csp_billing_adapter.exceptions import CSPBillingAdapterException
+
+pm = get_plugin_manager()
+config = Config.load_from_file(
+    'tests/data/good_config.yaml',
+    pm.hook
+)
+now = datetime.now().isoformat()
+cache = {
+    'adapter_start_time': now,
+    'next_bill_time': now,
+    'next_reporting_time': now,
+    'usage_records': [],
+    'last_bill': {}
+}
+csp_config = {
+    'billing_api_access_ok': True,
+    'timestamp': now,
+    'expire': now,
+    'errors': []
+}
+metering_archive = [
+    {
+        'billing_time': '2024-02-09T18:11:59.527064+00:00',
+        'billing_status': {
+            'tier_1': {
+                'record_id': '123',
+                'status': 'succeeded'
+            }
+        },
+        'billed_usage': {
+            'tier_1': 10
+        },
+        'usage_records': [
+            {
+                'managed_node_count': 10,
+                'reporting_time': '2024-02-09T18:11:59.527064+00:00',
+                'base_product': 'cpe:/o:suse:product:v1.2.3'
+            }
+        ]
+    }
+]
+
+
+def create_exception(status: int):
+    response = Mock()
+    response.status = status
+    response.reason = 'Borked'
+    response.data = '"message": "Borked!"'
+    response.getheaders.return_value = None
+    return ApiException(http_resp=response)
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'storage' / 'adapter.db')
+    monkeypatch.setattr(sqlite_storage, 'db_path', path)
+    yield path
+    sqlite_storage.close()
+
+
+def test_wal_mode(db_path):
+    sqlite_storage.get_cache(config)
+
+    conn = sqlite3.connect(db_path)
+    mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    conn.close()
+    assert mode == 'wal'
+
+
+def test_cache(db_path):
+    assert sqlite_storage.get_cache(config) is None
+
+    sqlite_storage.save_cache(config, cache)
+    assert sqlite_storage.get_cache(config) == cache
+
+    # Save does not overwrite an existing cache
+    sqlite_storage.save_cache(config, {'other': 'info'})
+    assert sqlite_storage.get_cache(config) == cache
+
+    sqlite_storage.update_cache(config, {'other': 'info'}, replace=False)
+    assert sqlite_storage.get_cache(config) == {**cache, 'other': 'info'}
+
+    sqlite_storage.update_cache(config, {'other': 'info'}, replace=True)
+    assert sqlite_storage.get_cache(config) == {'other': 'info'}
+
+
+def test_csp_config(db_path):
+    assert sqlite_storage.get_csp_config(config) is None
+
+    sqlite_storage.save_csp_config(config, csp_config)
+    sqlite_storage.save_csp_config(config, {'other': 'info'})
+    assert sqlite_storage.get_csp_config(config) == csp_config
+
+    sqlite_storage.update_csp_config(config, {'other': 'info'}, replace=False)
+    assert sqlite_storage.get_csp_config(config) == {
+        **csp_config,
+        'other': 'info'
+    }
+
+    sqlite_storage.update_csp_config(config, {'other': 'info'}, replace=True)
+    assert sqlite_storage.get_csp_config(config) == {'other': 'info'}
+
+
+def test_metering_archive(db_path):
+    assert sqlite_storage.get_metering_archive(config) == []
+
+    second = {**metering_archive[0], 'billing_time': '2024-03-09T18:11:59'}
+    sqlite_storage.save_metering_archive(config, [*metering_archive, second])
+    assert sqlite_storage.get_metering_archive(config) == [
+        *metering_archive,
+        second
+    ]
+
+    entry = sqlite_storage.get_archive_entry(config, second['billing_time'])
+    assert entry == second
+    assert sqlite_storage.get_archive_entry(config, 'missing') is None
+
+    summary = sqlite_storage.get_archive_summary(config)
+    assert summary['entries'] == 2
+    assert summary['first_billing_time'] == metering_archive[0][
+        'billing_time'
+    ]
+    assert summary['last_billing_time'] == second['billing_time']
+
+    # Save replaces the stored archive
+    sqlite_storage.save_metering_archive(config, [second])
+    assert sqlite_storage.get_metering_archive(config) == [second]
+
+
+def test_connection_reused(db_path):
+    with patch.object(
+        sqlite_storage,
+        '_open_connection',
+        wraps=sqlite_storage._open_connection
+    ) as mock_open:
+        sqlite_storage.save_cache(config, cache)
+        sqlite_storage.get_cache(config)
+        sqlite_storage.get_metering_archive(config)
+
+    mock_open.assert_called_once()
+
+
+def test_connection_reopened(db_path, tmp_path, monkeypatch):
+    with sqlite_storage._connect() as conn:
+        first = conn
+
+    monkeypatch.setattr(
+        sqlite_storage,
+        'db_path',
+        str(tmp_path / 'other.db')
+    )
+
+    with sqlite_storage._connect() as conn:
+        assert conn is not first
+
+    # An error closes the connection so the next call opens a new one
+    with pytest.raises(sqlite3.OperationalError):
+        with sqlite_storage._connect() as conn:
+            conn.execute('SELECT * FROM missing')
+
+    assert sqlite_storage.connection is None
+
+    with sqlite_storage._connect() as new_conn:
+        assert new_conn is not conn
+
+
+def test_save_metering_archive_changed_only(db_path):
+    archive = [
+        {**metering_archive[0], 'billing_time': str(i)} for i in range(3)
+    ]
+    sqlite_storage.save_metering_archive(config, archive)
+
+    with sqlite_storage._connect() as conn:
+        changes = conn.total_changes
+
+    # Saving the same archive writes nothing
+    sqlite_storage.save_metering_archive(config, archive)
+
+    with sqlite_storage._connect() as conn:
+        assert conn.total_changes == changes
+
+    # One changed entry and one new entry
+    archive[1] = {**archive[1], 'billed_usage': {'tier_1': 20}}
+    archive.append({**metering_archive[0], 'billing_time': '3'})
+    sqlite_storage.save_metering_archive(config, archive)
+
+    with sqlite_storage._connect() as conn:
+        assert conn.total_changes == changes + 2
+
+    assert sqlite_storage.get_metering_archive(config) == archive
+
+    # Positions past the end are deleted
+    sqlite_storage.save_metering_archive(config, archive[:2])
+    assert sqlite_storage.get_metering_archive(config) == archive[:2]
+    assert sqlite_storage.get_archive_entry(config, '3') is None
+
+
+def test_billing_time_index_used(db_path):
+    sqlite_storage.save_metering_archive(config, metering_archive)
+
+    conn = sqlite3.connect(db_path)
+    plan = conn.execute(
+        'EXPLAIN QUERY PLAN SELECT entry FROM metering_archive '
+        'WHERE billing_time = ?',
+        ('x',)
+    ).fetchall()
+    conn.close()
+    assert 'metering_archive_billing_time' in str(plan)
+
+
+def test_update_rolls_back_on_error(db_path):
+    sqlite_storage.save_cache(config, cache)
+
+    with pytest.raises(TypeError):
+        sqlite_storage.update_cache(config, {'bad': object()}, replace=False)
+
+    assert sqlite_storage.get_cache(config) == cache
+
+
+@pytest.mark.parametrize(
+    'function,args,message',
+    [
+        ('save_cache', (cache,), 'Failed to save cache'),
+        ('get_cache', (), 'Failed to get cache'),
+        ('update_cache', (cache, True), 'Failed to update cache'),
+        ('get_csp_config', (), 'Failed to get csp config'),
+        ('update_csp_config', (csp_config, True),
+         'Failed to update csp config'),
+        ('save_csp_config', (csp_config,), 'Failed to save csp config'),
+        ('get_metering_archive', (), 'Failed to get metering archive'),
+        ('save_metering_archive', (metering_archive,),
+         'Failed to save metering archive'),
+        ('get_archive_entry', ('missing',), 'Failed to get archive entry'),
+        ('get_archive_status', (), 'Failed to get archive status'),
+        ('get_archive_summary', (), 'Failed to get archive summary'),
+    ]
+)
+@patch('csp_billing_adapter_k8s.sqlite_storage._connect')
+def test_storage_error(mock_connect, function, args, message):
+    mock_connect.side_effect = sqlite3.OperationalError('disk I/O error')
+
+    with pytest.raises(CSPBillingAdapterException) as error:
+        getattr(sqlite_storage, function)(config, *args)
+
+    assert f'{message}. disk I/O error' in str(error.value)
+
+
+def test_storage_error_during_query(db_path):
+    sqlite_storage.save_metering_archive(config, metering_archive)
+
+    with sqlite_storage._connect() as conn:
+        conn.execute('DROP TABLE metering_archive')
+
+    with pytest.raises(CSPBillingAdapterException) as error:
+        sqlite_storage.get_archive_entry(config, 'missing')
+
+    assert 'Failed to get archive entry. no such table' in str(error.value)
+
+    # The connection is reopened and the schema is created again
+    assert sqlite_storage.get_archive_entry(config, 'missing') is None
+
+
+def test_storage_error_schema(db_path):
+    with patch.object(sqlite_storage, 'SCHEMA', ('CREATE TABLE',)):
+        with pytest.raises(CSPBillingAdapterException) as error:
+            sqlite_storage.get_cache(config)
+
+    assert 'Failed to get cache' in str(error.value)
+    assert sqlite_storage.connection is None
+    assert sqlite_storage.get_cache(config) is None
+
+
+def test_storage_error_rolls_back(db_path):
+    sqlite_storage.save_metering_archive(config, metering_archive)
+
+    with patch.object(
+        sqlite_storage.codec,
+        'dumps_str',
+        side_effect=sqlite3.DataError('bad entry')
+    ):
+        with pytest.raises(CSPBillingAdapterException):
+            sqlite_storage.save_metering_archive(config, [cache])
+
+    assert sqlite_storage.get_metering_archive(config) == metering_archive
+
+
+@patch.object(plugin, 'storage_backend', 'sqlite')
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_plugin_sqlite_backend(mock_client, db_path):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+
+    plugin.save_cache(config, cache)
+    assert plugin.get_cache(config) == cache
+
+    plugin.save_csp_config(config, csp_config)
+    assert plugin.get_csp_config(config) == csp_config
+
+    plugin.save_metering_archive(config, metering_archive)
+    assert plugin.get_metering_archive(config) == metering_archive
+
+    # Only the archive summary is mirrored to the cluster
+    api.read_namespaced_secret.assert_not_called()
+    api.create_namespaced_secret.assert_not_called()
+    api.patch_namespaced_config_map.assert_called_once()
+    name, _, body = api.patch_namespaced_config_map.call_args[0]
+    assert name == 'metering-archive'
+    assert '"entries":1' in body['data']['summary']
+
+    assert plugin.get_archive_location() == 'metering-archive'
+
+
+@patch.object(plugin, 'storage_backend', 'sqlite')
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_plugin_sqlite_summary_created(mock_client, db_path):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+    api.patch_namespaced_config_map.side_effect = create_exception(404)
+
+    plugin.save_metering_archive(config, metering_archive)
+    api.create_namespaced_config_map.assert_called_once()
+
+
+@patch.object(plugin, 'storage_backend', 'sqlite')
+@patch('csp_billing_adapter_k8s.plugin.client')
+def test_plugin_sqlite_summary_error(mock_client, db_path):
+    api = Mock()
+    mock_client.CoreV1Api.return_value = api
+    api.patch_namespaced_config_map.side_effect = create_exception(404)
+    api.create_namespaced_config_map.side_effect = create_exception(400)
+
+    with pytest.raises(CSPBillingAdapterException):
+        plugin.save_metering_archive(config, metering_archive)
+
+    api.patch_namespaced_config_map.side_effect = create_exception(400)
+    with pytest.raises(CSPBillingAdapterException):
+        plugin.save_metering_archive(config, metering_archive)
+
+
+@patch.object(plugin, 'storage_mirror_summary', False)
+@patch.object(plugin, 'storage_backend', 'sqlite')
+def test_plugin_sqlite_archive_location(db_path):
+    assert plugin.get_archive_location() == db_path
+
+
+@patch.object(plugin, 'storage_backend', 'sqlite')
+def test_plugin_sqlite_archive_queries(db_path):
+    second = {
+        **metering_archive[0],
+        'billing_time': '2024-03-09T18:11:59',
+        'billing_status': {'tier_1': {'status': 'failed'}}
+    }
+    sqlite_storage.save_metering_archive(config, [*metering_archive, second])
+
+    assert plugin.get_archive_entry(config, second['billing_time']) == second
+    assert plugin.get_archive_status(config) == {
+        metering_archive[0]['billing_time']: {'tier_1': 'succeeded'},
+        second['billing_time']: {'tier_1': 'failed'}
+    }
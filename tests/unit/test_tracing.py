@@ -0,0 +1,234 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import sys
+import pytest
+
+from unittest.mock import patch
+
+from csp_billing_adapter.config import Config
+from csp_billing_adapter_k8s import plugin, tracing
+from csp_billing_adapter_k8s.credentials import CredentialManager
+from csp_billing_adapter_k8s.fault_injection import (
+    FakeApiServer,
+    FaultInjectingTransport,
+    FaultProfile,
+    create_api_client,
+    status_body
+)
+
+pytest.importorskip('opentelemetry.sdk')
+
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (  # noqa
+    InMemorySpanExporter
+)
+
+CONFIG_MAPS = '/api/v1/namespaces/product-billing-adapter/configmaps'
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemorySpanExporter()
+    provider = tracing.setup_tracing(exporter)
+    exporter.provider = provider
+    yield exporter
+    tracing.tracer = None
+
+
+@pytest.fixture
+def server():
+    server = FakeApiServer()
+    original_client = plugin.api_client
+    plugin.api_client = create_api_client(
+        FaultInjectingTransport(server, FaultProfile())
+    )
+    yield server
+    plugin.api_client = original_client
+
+
+def finished_spans(exporter):
+    exporter.provider.force_flush()
+    return {span.name: span for span in exporter.get_finished_spans()}
+
+
+def test_tracing_disabled():
+    assert tracing.tracer is None
+    assert tracing.setup_tracing() is None
+
+    with tracing.span('test', {'key': 'value'}) as current:
+        current.set_attribute('key', 'value')
+
+    @tracing.traced
+    def hook(config):
+        return config
+
+    assert hook(config='config') == 'config'
+
+
+def test_hook_spans(exporter, server):
+    config = Config({})
+    plugin.save_cache(config=config, cache={'a': 1})
+    assert plugin.get_cache(config=config) == {'a': 1}
+
+    spans = finished_spans(exporter)
+    create = spans['k8s.create_namespaced_secret']
+    read = spans['k8s.read_namespaced_secret']
+
+    assert create.parent.span_id == spans['hook.save_cache'].context.span_id
+    assert read.parent.span_id == spans['hook.get_cache'].context.span_id
+    assert spans['serialize.cache'].parent.span_id == (
+        spans['hook.save_cache'].context.span_id
+    )
+    assert create.attributes['k8s.object.name'] == 'csp-adapter-cache'
+    assert create.attributes['k8s.status'] == 'Success'
+    assert create.attributes['k8s.resource_version'] == '1'
+    assert create.attributes['payload.bytes'] == 12
+    assert spans['serialize.cache'].attributes['payload.bytes'] == 12
+    assert spans['deserialize.cache'].attributes['payload.bytes'] == 12
+
+
+def test_api_error_span(exporter, server):
+    assert plugin.get_cache(config=Config({})) is None
+
+    read = finished_spans(exporter)['k8s.read_namespaced_secret']
+    assert read.attributes['http.status_code'] == 404
+    assert read.attributes['k8s.status'] == 'Failure'
+    assert not read.status.is_ok
+
+
+def test_retry_span(exporter, server):
+    archive_path = f'{CONFIG_MAPS}/metering-archive'
+    handle = server.handle
+
+    def create_concurrently(method, path, body):
+        # Another writer creates the archive after the patch fails
+        if method == 'PATCH' and path == archive_path and (
+            archive_path not in server.objects
+        ):
+            server.add_object(
+                archive_path,
+                {'metadata': {'name': 'metering-archive'}}
+            )
+            return 404, status_body(404, 'NotFound')
+
+        return handle(method, path, body)
+
+    server.handle = create_concurrently
+    archive = [{'billing_time': '2024-01-01T00:00:00Z'}]
+    plugin.save_metering_archive(config=Config({}), archive_data=archive)
+
+    spans = finished_spans(exporter)
+    retry = spans['retry']
+    patch_span = next(
+        span for span in exporter.get_finished_spans()
+        if span.name == 'k8s.patch_namespaced_config_map'
+        and span.parent.span_id == retry.context.span_id
+    )
+
+    assert retry.attributes['retry.reason'] == 'AlreadyExists'
+    create = [
+        span.attributes.get('http.status_code')
+        for span in exporter.get_finished_spans()
+        if span.name == 'k8s.create_namespaced_config_map'
+    ]
+    # The index config map is created after the archive
+    assert create == [409, None]
+    assert patch_span.attributes['k8s.resource_version'] == '2'
+    assert spans['serialize.archive'].attributes['archive.entries'] == 1
+    assert json.loads(
+        server.get_object(archive_path)['data']['archive']
+    ) == archive
+
+
+@patch.object(plugin, 'api_client', None)
+@patch.object(plugin, 'credential_manager', CredentialManager())
+@patch('csp_billing_adapter_k8s.credentials.load_incluster_config')
+def test_setup_adapter_span(mock_load_config, exporter):
+    plugin.setup_adapter(config=Config({}))
+
+    spans = finished_spans(exporter)
+    assert spans['k8s.load_config'].attributes['k8s.config'] == 'incluster'
+    assert spans['k8s.load_config'].parent.span_id == (
+        spans['hook.setup_adapter'].context.span_id
+    )
+
+
+def test_file_exporter(tmp_path, monkeypatch):
+    trace_file = tmp_path / 'traces.jsonl'
+    monkeypatch.setenv('TRACING_EXPORTER', 'file')
+    monkeypatch.setenv('TRACING_FILE', str(trace_file))
+
+    try:
+        tracing.setup_tracing()
+
+        with tracing.span('outer', {'payload.bytes': 10, 'skipped': None}):
+            with tracing.span('inner'):
+                pass
+    finally:
+        tracing.tracer = None
+
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [span['name'] for span in spans] == ['inner', 'outer']
+    assert spans[1]['attributes'] == {'payload.bytes': 10}
+    assert spans[1]['resource']['attributes']['service.name'] == (
+        'csp-billing-adapter-k8s'
+    )
+
+
+def test_custom_exporter(monkeypatch):
+    monkeypatch.setenv(
+        'TRACING_EXPORTER',
+        'opentelemetry.sdk.trace.export.in_memory_span_exporter:'
+        'InMemorySpanExporter'
+    )
+
+    try:
+        provider = tracing.setup_tracing()
+    finally:
+        tracing.tracer = None
+
+    processor = provider._active_span_processor._span_processors[0]
+    assert isinstance(processor.span_exporter, InMemorySpanExporter)
+
+
+@pytest.mark.parametrize('name', [
+    'jaeger',
+    'opentelemetry.sdk.trace.export:MissingExporter',
+    ':InMemorySpanExporter'
+])
+def test_exporter_not_loaded(monkeypatch, caplog, name):
+    monkeypatch.setenv('TRACING_EXPORTER', name)
+
+    assert tracing.setup_tracing() is None
+    assert tracing.tracer is None
+    assert f'Unable to load the {name} exporter' in caplog.text
+
+    with tracing.span('noop') as current:
+        current.set_attribute('key', 'value')
+
+
+def test_otlp_exporter_not_installed(monkeypatch, caplog):
+    monkeypatch.setenv('TRACING_EXPORTER', 'otlp')
+    # A None entry makes the import raise ImportError
+    monkeypatch.setitem(
+        sys.modules,
+        'opentelemetry.exporter.otlp.proto.http.trace_exporter',
+        None
+    )
+
+    assert tracing.setup_tracing() is None
+    assert 'Tracing disabled' in caplog.text
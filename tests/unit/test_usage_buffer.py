@@ -0,0 +1,143 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from csp_billing_adapter_k8s.usage_buffer import (
+    MetricAggregate,
+    UsageAggregator
+)
+from csp_billing_adapter.config import Config
+from csp_billing_adapter.adapter import get_plugin_manager
+
+pm = get_plugin_manager()
+config = Config.load_from_file(
+    'tests/data/good_config.yaml',
+    pm.hook
+)
+
+
+def test_metric_aggregate_slots():
+    aggregate = MetricAggregate(0, 1)
+    assert not hasattr(aggregate, '__dict__')
+
+
+def test_metric_aggregate():
+    aggregate = MetricAggregate(0, 10)
+    aggregate.add(10, 30)
+    aggregate.add(20, 20)
+
+    assert aggregate.maximum == 30
+    assert aggregate.mean() == 20
+    # 10 for 10s, 30 for 10s, 20 for 20s
+    assert aggregate.time_weighted_mean(40) == 20
+    assert aggregate.time_weighted_mean(20) == 20
+
+
+def test_metric_aggregate_single_sample():
+    aggregate = MetricAggregate(5, 7)
+    assert aggregate.time_weighted_mean(5) == 7
+    assert aggregate.time_weighted_mean(0) == 7
+
+
+def test_buffer_average():
+    buffer = UsageAggregator()
+    assert buffer.aggregate(config, now=0) is None
+
+    buffer.record(
+        {'managed_node_count': 10, 'reporting_time': 'a'},
+        timestamp=0
+    )
+    # Short spike is weighted by the time it was held
+    buffer.record(
+        {'managed_node_count': 110, 'reporting_time': 'b'},
+        timestamp=90
+    )
+    buffer.record(
+        {'managed_node_count': 10, 'reporting_time': 'c'},
+        timestamp=100
+    )
+    assert len(buffer) == 3
+
+    usage = buffer.aggregate(config, now=200)
+    assert usage == {'managed_node_count': 15, 'reporting_time': 'c'}
+    assert len(buffer) == 0
+
+    # The next interval starts with the last value
+    usage = buffer.aggregate(config, now=300)
+    assert usage['managed_node_count'] == 10
+
+
+def test_buffer_maximum():
+    maximum_config = Config({
+        'usage_metrics': {
+            'managed_node_count': {'usage_aggregation': 'maximum'}
+        }
+    })
+    buffer = UsageAggregator()
+    buffer.record({'managed_node_count': 10}, timestamp=0)
+    buffer.record({'managed_node_count': 110}, timestamp=90)
+    buffer.record({'managed_node_count': 10}, timestamp=100)
+
+    assert buffer.aggregate(maximum_config, now=200) == {
+        'managed_node_count': 110
+    }
+    assert buffer.aggregate(maximum_config, now=300) == {
+        'managed_node_count': 10
+    }
+
+
+def test_buffer_constant_size():
+    buffer = UsageAggregator()
+
+    for timestamp in range(1000):
+        buffer.record({'managed_node_count': timestamp}, timestamp=timestamp)
+
+    assert len(buffer) == 1000
+    assert list(buffer.aggregates) == ['managed_node_count']
+    assert buffer.aggregates['managed_node_count'].count == 1000
+
+
+def test_buffer_ignores_non_numeric_fields():
+    buffer = UsageAggregator()
+    buffer.record({
+        'managed_node_count': 1,
+        'base_product': 'cpe:/o:suse:product:v1.2.3',
+        'enabled': True
+    })
+
+    assert list(buffer.aggregates) == ['managed_node_count']
+
+
+def test_buffer_clear():
+    buffer = UsageAggregator()
+    buffer.record({'managed_node_count': 1}, timestamp=0)
+    buffer.clear()
+
+    assert len(buffer) == 0
+    assert buffer.aggregates == {}
+    assert buffer.aggregate(config, now=10) is None
+
+
+def test_buffer_stale():
+    now = [100]
+    buffer = UsageAggregator(clock=lambda: now[0])
+    assert buffer.is_stale(60)
+
+    buffer.touch()
+    now[0] = 160
+    assert not buffer.is_stale(60)
+
+    now[0] = 161
+    assert buffer.is_stale(60)
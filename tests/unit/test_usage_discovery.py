@@ -0,0 +1,152 @@
+#
+# Copyright 2023 SUSE LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from kubernetes.client import (
+    V1APIGroup,
+    V1APIGroupList,
+    V1APIResource,
+    V1APIResourceList,
+    V1GroupVersionForDiscovery
+)
+
+from csp_billing_adapter_k8s.usage_discovery import (
+    DiscoveryCache,
+    UsageResource,
+    find_api_group,
+    find_api_resource,
+    select_version
+)
+
+
+def api_group(name, versions, preferred):
+    group_versions = [
+        V1GroupVersionForDiscovery(
+            group_version=f'{name}/{version}',
+            version=version
+        )
+        for version in versions
+    ]
+    return V1APIGroup(
+        name=name,
+        versions=group_versions,
+        preferred_version=group_versions[versions.index(preferred)]
+    )
+
+
+def api_resource(name, namespaced=False):
+    return V1APIResource(
+        name=name,
+        kind='UsageRecord',
+        namespaced=namespaced,
+        singular_name='',
+        verbs=['get']
+    )
+
+
+def test_find_api_group():
+    group = api_group('product.com', ['v1'], 'v1')
+    group_list = V1APIGroupList(
+        groups=[api_group('apps', ['v1'], 'v1'), group]
+    )
+
+    assert find_api_group(group_list, 'product.com') is group
+    assert find_api_group(group_list, 'missing.com') is None
+    assert find_api_group(V1APIGroupList(groups=[]), 'product.com') is None
+
+
+def test_select_version(caplog):
+    group = api_group('product.com', ['v1', 'v2'], 'v2')
+
+    assert select_version(group) == 'v2'
+    assert select_version(group, 'v1') == 'v1'
+    assert not caplog.records
+
+    assert select_version(group, 'v1beta1') == 'v2'
+    assert 'v1beta1 is not served' in caplog.text
+    assert 'Served versions: v1, v2.' in caplog.text
+
+
+def test_find_api_resource():
+    resource_list = V1APIResourceList(
+        group_version='product.com/v1',
+        resources=[
+            api_resource('records/status', namespaced=True),
+            api_resource('records', namespaced=True)
+        ]
+    )
+
+    resource = find_api_resource(resource_list, 'records')
+    assert resource.name == 'records'
+    assert resource.namespaced
+    assert find_api_resource(resource_list, 'missing') is None
+
+
+def test_usage_resource_api_kwargs():
+    resource = UsageResource('product.com', 'v1', 'records', 'usage')
+
+    assert not resource.namespaced
+    assert resource.api_kwargs() == {
+        'group': 'product.com',
+        'version': 'v1',
+        'plural': 'records'
+    }
+
+    resource.namespace = 'billing'
+    assert resource.namespaced
+    assert resource.api_kwargs()['namespace'] == 'billing'
+
+
+def test_discovery_cache_ttl():
+    now = [0.0]
+    cache = DiscoveryCache(ttl=60, clock=lambda: now[0])
+    resource = UsageResource('product.com', 'v1', 'records', 'usage')
+
+    assert not cache.fresh()
+
+    cache.set(resource)
+    now[0] = 59.9
+    assert cache.fresh()
+    assert cache.resource is resource
+
+    now[0] = 60
+    assert not cache.fresh()
+
+    # Resources that are not served are cached
+    cache.set(None)
+    assert cache.fresh()
+    assert cache.resource is None
+
+    cache.invalidate()
+    assert not cache.fresh()
+
+
+def test_discovery_cache_negative_ttl():
+    now = [0.0]
+    cache = DiscoveryCache(ttl=60, negative_ttl=5, clock=lambda: now[0])
+
+    cache.set(None)
+    now[0] = 4.9
+    assert cache.fresh()
+
+    now[0] = 5
+    assert not cache.fresh()
+
+    cache.set(UsageResource('product.com', 'v1', 'records', 'usage'))
+    now[0] = 60
+    assert cache.fresh()
+
+    cache.invalidate()
+    assert not cache.fresh()